@@ -1,2 +1,3 @@
 from .fileformat import FileFormat
-from .callback_command import CallbackCommand
\ No newline at end of file
+from .callback_command import CallbackCommand
+from .job_priority import JobPriority
\ No newline at end of file
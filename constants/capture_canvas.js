@@ -0,0 +1,57 @@
+// Returns the canvases of the current page as one PNG data URL, cropped to
+// their bounds, or null when there is nothing to read or a canvas is tainted.
+var screen = document.querySelector('div.currentScreen');
+if (!screen) {
+    return null;
+}
+var canvases = [];
+var bounds = null;
+var scale = 1;
+var elements = screen.querySelectorAll('canvas');
+for (var index = 0; index < elements.length; index++) {
+    var canvas = elements[index];
+    var rect = canvas.getBoundingClientRect();
+    if (!canvas.width || !canvas.height || !rect.width || !rect.height
+        || window.getComputedStyle(canvas).visibility === 'hidden') {
+
+        continue;
+    }
+    canvases.push({canvas: canvas, rect: rect});
+    scale = Math.max(scale, canvas.width / rect.width);
+    if (bounds === null) {
+        bounds = {
+            left: rect.left, top: rect.top,
+            right: rect.right, bottom: rect.bottom
+        };
+    } else {
+        bounds.left = Math.min(bounds.left, rect.left);
+        bounds.top = Math.min(bounds.top, rect.top);
+        bounds.right = Math.max(bounds.right, rect.right);
+        bounds.bottom = Math.max(bounds.bottom, rect.bottom);
+    }
+}
+if (!canvases.length) {
+    return null;
+}
+var page = document.createElement('canvas');
+page.width = Math.round((bounds.right - bounds.left) * scale);
+page.height = Math.round((bounds.bottom - bounds.top) * scale);
+var context = page.getContext('2d');
+context.fillStyle = '#ffffff';
+context.fillRect(0, 0, page.width, page.height);
+for (var index = 0; index < canvases.length; index++) {
+    var rect = canvases[index].rect;
+    context.drawImage(
+        canvases[index].canvas,
+        Math.round((rect.left - bounds.left) * scale),
+        Math.round((rect.top - bounds.top) * scale),
+        Math.round(rect.width * scale),
+        Math.round(rect.height * scale)
+    );
+}
+try {
+    return page.toDataURL('image/png');
+} catch (error) {
+    // SecurityError, the reader drew cross-origin images.
+    return null;
+}
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+
+import enum
+
+class JobPriority(enum.IntEnum):
+    # Lower values are served first.
+    download = 0
+    conversion = 1
+    refresh = 2
+    thumbnail = 3
@@ -0,0 +1,73 @@
+// Lets the webdriver wait for the DMM reader instead of sleeping.
+window.dmmReaderHook = {
+    getCounter: function() {
+        var counter = document.getElementById('pageSliderCounter');
+        return counter ? counter.textContent : null;
+    },
+
+    isVisible: function(element, property, hiddenValue) {
+        return window.getComputedStyle(element)[property] !== hiddenValue;
+    },
+
+    isReady: function() {
+        var loadings = document.querySelectorAll('div.loading');
+        for (var index = 0; index < loadings.length; index++) {
+            if (window.getComputedStyle(loadings[index])
+                .visibility === 'visible') {
+
+                return false;
+            }
+        }
+        var screen = document.querySelector('div.currentScreen');
+        return screen !== null
+            && window.dmmReaderHook.isVisible(screen, 'visibility', 'hidden');
+    },
+
+    // Calls back with the page counter once the page differs from
+    // previousCounter (null to skip the check), the reader stopped changing
+    // the page for settleTime milliseconds and the canvas is painted.
+    waitForPage: function(previousCounter, settleTime, callback) {
+        var hook = window.dmmReaderHook;
+        var observer = new MutationObserver(check);
+        var timer = null;
+
+        function isShown() {
+            return hook.isReady() && (previousCounter === null
+                || hook.getCounter() !== previousCounter);
+        }
+
+        function done() {
+            timer = null;
+            if (!isShown()) {
+                return;
+            }
+            observer.disconnect();
+            // Two frames so the canvas drawn in this one has been painted.
+            window.requestAnimationFrame(function() {
+                window.requestAnimationFrame(function() {
+                    callback(hook.getCounter());
+                });
+            });
+        }
+
+        // Every mutation restarts the settle time, the reader may still
+        // swap the canvas or the loading overlay right after the counter.
+        function check() {
+            if (timer !== null) {
+                window.clearTimeout(timer);
+                timer = null;
+            }
+            if (isShown()) {
+                timer = window.setTimeout(done, settleTime);
+            }
+        }
+
+        observer.observe(document.body, {
+            attributes: true,
+            childList: true,
+            characterData: true,
+            subtree: true
+        });
+        check();
+    }
+};
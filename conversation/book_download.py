@@ -3,6 +3,7 @@ from telegram import KeyboardButton, ParseMode
 from constants import CallbackCommand, FileFormat
 from db_utils import Database
 from cron_job_manager import CronJobManager
+from page_manifest import PageManifest
 from os import path
 from sendclient import delete
 import logging
@@ -71,8 +72,8 @@ class BookDownloadHandler(ConversationHandler):
         book_path = utils.get_book_download_path(self.download_path, book)
         if not utils.dir_exists(book_path):
             utils.create_dir(book_path)
-        book_images = utils.get_book_page_num_list(book_path)
-        missing_images = utils.book_missing_pages(1, book.pages, book_images)
+        missing_images = PageManifest.load(book_path) \
+            .get_missing_pages(book.pages)
         is_toc_missing = not utils.dir_exists(path.join(book_path, 'toc.txt'))
         self.logger.info('User %s requested to download book %s',
             user.id, book.id)
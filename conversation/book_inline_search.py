@@ -9,70 +9,105 @@ from telegram.ext import (InlineQueryHandler, CallbackQueryHandler,
     ChosenInlineResultHandler)
 from constants import CallbackCommand
 from db_utils import Database, MangaSeries
+from library_cache import LibraryCache
 
 import utilities as utils
 
 class BookSearchHandler(InlineQueryHandler):
 
     series_regex = r'^serie ([0-9]+):(.*)'
+    # Telegram accepts up to 50 results per answer.
+    page_size = 20
 
     def __init__(self, lang):
         self.lang = lang
         self.db_manager = Database.get_instance()
+        self.library_cache = LibraryCache.get_instance()
         InlineQueryHandler.__init__(self, self.inline_query, pass_chat_data=True)
 
     def inline_query(self, bot, update, chat_data):
-        results = []
         user_id = update.inline_query.from_user.id
         query = update.inline_query.query
+        offset = 0
+        if update.inline_query.offset.isdigit():
+            offset = int(update.inline_query.offset)
+        page = self.library_cache.get_page(user_id, query, offset)
+        if page == None:
+            page = self.get_page(user_id, query, offset)
+        results, next_offset = page
+        update.inline_query.answer(results, is_personal=True,
+            next_offset=next_offset)
+
+    def get_page(self, user_id, query, offset):
+        results = []
+        articles = {}
+        generation = self.library_cache.get_generation(user_id)
         session = self.db_manager.create_session()
-        user = self.db_manager.get_user(session, user_id)
-        language_code = user.language_code
+        language_code = self.library_cache.get_language_code(user_id)
+        if language_code == None:
+            language_code = self.db_manager.get_user(session, user_id) \
+                .language_code
+        # Ranked and paged by the database, one extra book tells whether
+        # another page follows.
         match = re.match(BookSearchHandler.series_regex, query)
         if match:
-            result = self.db_manager.get_user_volumes_from_serie(
-                session, user_id, match.group(1), match.group(2)
+            books = self.db_manager.get_user_volumes_from_serie(
+                session, user_id, match.group(1), match.group(2).strip(),
+                offset, BookSearchHandler.page_size + 1
             )
         else:
-            result = self.db_manager.get_user_library_by_title(
-                session, user_id, query
-            )
-        for book in result:
-            if isinstance(book, MangaSeries):
-                description = book.volumes[0].description
-                buttons = InlineKeyboardMarkup(
-                    [
-                        [InlineKeyboardButton(
-                            self.lang[language_code]['search_volume'], 
-                            switch_inline_query_current_chat='serie {}: ' \
-                                .format(book.id)
-                        )]
-                    ]
-                )
-            else:
-                description = book.description
-                buttons = InlineKeyboardMarkup(
-                    [
-                        [InlineKeyboardButton(
-                            self.lang[language_code]['download'], 
-                            callback_data=str({
-                                'cmd': CallbackCommand.download.value,
-                                'book': book.id
-                            })
-                        )]
-                    ]
-                )
-            results.append(
-                InlineQueryResultArticle(
-                    id=uuid4(),
-                    title=book.title,
-                    description=description,
-                    thumb_url=book.thumbnail_dmm,
-                    input_message_content=InputTextMessageContent(
-                        book.title
-                    ),
-                    reply_markup=buttons
-                )
+            books = self.db_manager.get_user_library_by_title(
+                session, user_id, query, offset,
+                BookSearchHandler.page_size + 1
             )
+        next_offset = ''
+        if len(books) > BookSearchHandler.page_size:
+            books = books[:BookSearchHandler.page_size]
+            next_offset = str(offset + BookSearchHandler.page_size)
+        for book in books:
+            key = (isinstance(book, MangaSeries), book.id)
+            article = self.library_cache.get_article(user_id, key)
+            if article == None:
+                article = self.get_result_article(book, language_code)
+                articles[key] = article
+            results.append(article)
         self.db_manager.remove_session()
-        update.inline_query.answer(results, is_personal=True)
+        page = (results, next_offset)
+        self.library_cache.set_page(user_id, language_code, query, offset,
+            page, articles, generation)
+        return page
+
+    def get_result_article(self, book, language_code):
+        if isinstance(book, MangaSeries):
+            buttons = InlineKeyboardMarkup(
+                [
+                    [InlineKeyboardButton(
+                        self.lang[language_code]['search_volume'], 
+                        switch_inline_query_current_chat='serie {}: ' \
+                            .format(book.id)
+                    )]
+                ]
+            )
+        else:
+            buttons = InlineKeyboardMarkup(
+                [
+                    [InlineKeyboardButton(
+                        self.lang[language_code]['download'], 
+                        callback_data=str({
+                            'cmd': CallbackCommand.download.value,
+                            'book': book.id
+                        })
+                    )]
+                ]
+            )
+        # Series carry the description of their first volume.
+        return InlineQueryResultArticle(
+            id=uuid4(),
+            title=book.title,
+            description=book.description,
+            thumb_url=book.thumbnail_dmm,
+            input_message_content=InputTextMessageContent(
+                book.title
+            ),
+            reply_markup=buttons
+        )
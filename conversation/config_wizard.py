@@ -3,6 +3,7 @@ from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove)
 
 from cron_job_manager import CronJobManager
 from db_utils import Database, FileFormat
+from library_cache import LibraryCache
 import utilities as utils
 
 class ConfigWizard(ConversationHandler):
@@ -12,6 +13,7 @@ class ConfigWizard(ConversationHandler):
     def __init__(self, lang, language_codes, initial_state):
 
         self.db_manager = Database.get_instance()
+        self.library_cache = LibraryCache.get_instance()
         self.scheduler = CronJobManager.get_instance()
         self.lang = lang
         self.language_codes = language_codes
@@ -180,6 +182,7 @@ class ConfigWizard(ConversationHandler):
             self.db_manager.set_user_language(
                 session, user_id, reply_language_code
             )
+            self.library_cache.invalidate(user_id)
             self.db_manager.remove_session()
             self.request_config_menu(
                 bot, update, concat_message='short_selected_language'
@@ -2,7 +2,7 @@ from telegram.ext import (ConversationHandler, CommandHandler, RegexHandler)
 from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove)
 from cron_job_manager import CronJobManager
 from db_utils import Database
-import dmm_ripper as dmm
+from library_cache import LibraryCache
 import logging
 import utilities as utils
 
@@ -12,6 +12,7 @@ class StartWizard(ConversationHandler):
 
     def __init__(self, lang, language_codes, initial_state):
         self.db_manager = Database.get_instance()
+        self.library_cache = LibraryCache.get_instance()
         self.scheduler = CronJobManager.get_instance()
         self.logger = logging.getLogger(__name__)
         self.lang = lang
@@ -104,6 +105,7 @@ class StartWizard(ConversationHandler):
         else:
             session = self.db_manager.create_session()
             self.db_manager.set_user_language(session, user_id, language_code)
+            self.library_cache.invalidate(user_id)
             user = self.db_manager.get_user(session, user_id)
             self.db_manager.remove_session()
             self.request_email(
@@ -198,7 +200,9 @@ class StartWizard(ConversationHandler):
         )
         try:
             self.logger.info('Obtaining a new DMM session for user %s', user_id)
-            session = dmm.get_session(user.email, reply_password, True)
+            session = self.scheduler.dmm_ripper.get_session(
+                user.email, reply_password, True
+            )
             self.scheduler.add_user_cache_scheduler(user, session)
             self.logger.info('sending user %s configuration finished message.',
                 user.id)
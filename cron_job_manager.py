@@ -3,14 +3,22 @@ from apscheduler.jobstores.memory import MemoryJobStore
 #from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.executors.pool import ProcessPoolExecutor
 from apscheduler.events import EVENT_JOB_EXECUTED
+from apscheduler.jobstores.base import JobLookupError
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from db_utils import Database, User, Manga, MangaSeries
 from sendclient import upload
-from constants import CallbackCommand, FileFormat
+from constants import CallbackCommand, FileFormat, JobPriority
 from telegram import ParseMode
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from dmm_ripper import DMMRipper
+from library_cache import LibraryCache
+from page_encoder import PageEncoder
+from page_manifest import PageManifest
+from refresh_planner import RefreshPlanner
 import logging
+import math
+import threading
 import utilities as utils
 import pytz
 from os import path
@@ -23,11 +31,14 @@ class CronJobManager:
     start_min = 0
     download_path = utils.get_abs_path('./downloads')
     jobs = {}
+    refresh_users = {}
     book_job = {}
     lang = None
     logger = logging.getLogger(__name__)
     max_upload_size = None
     webdriver_config = None
+    scraper_config = None
+    scheduler_config = None
 
     def __init__(self):
 
@@ -37,15 +48,45 @@ class CronJobManager:
             self.update_cron_start_time()
             self.db_manager = Database.get_instance()
             self.dmm_ripper = DMMRipper.get_instance(
-                CronJobManager.webdriver_config
+                CronJobManager.webdriver_config,
+                CronJobManager.scraper_config
+            )
+            self.page_encoder = PageEncoder(
+                CronJobManager.webdriver_config['ENCODER_WORKERS'],
+                CronJobManager.webdriver_config['ENCODER_MAX_PENDING']
+            )
+            self.refresh_planner = RefreshPlanner(
+                CronJobManager.scheduler_config['REFRESH_WINDOW_MINUTES'],
+                self.dmm_ripper.http_client.refresh_budget.requests_per_second,
+                CronJobManager.scheduler_config['REFRESH_LIBRARY_PAGE_SIZE'],
+                CronJobManager.scheduler_config['REFRESH_NEW_VOLUMES_RATIO']
             )
             jobstores = {
                 # 'alchemy': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite'),
                 'default': MemoryJobStore()
             }
+            scheduler_config = CronJobManager.scheduler_config
+            # One executor per priority class, a burst of library refreshes
+            # can not hold back the downloads.
             executors = {
                 'default': {'type': 'threadpool', 'max_workers': 20},
-                'processpool': ProcessPoolExecutor(max_workers=5)
+                'processpool': ProcessPoolExecutor(max_workers=5),
+                JobPriority.download.name: {
+                    'type': 'threadpool',
+                    'max_workers': scheduler_config['DOWNLOAD_WORKERS']
+                },
+                JobPriority.conversion.name: {
+                    'type': 'threadpool',
+                    'max_workers': scheduler_config['CONVERSION_WORKERS']
+                },
+                JobPriority.refresh.name: {
+                    'type': 'threadpool',
+                    'max_workers': scheduler_config['REFRESH_WORKERS']
+                },
+                JobPriority.thumbnail.name: {
+                    'type': 'threadpool',
+                    'max_workers': scheduler_config['THUMBNAIL_WORKERS']
+                }
             }
             job_defaults = {
                 'coalesce': False,
@@ -59,6 +100,12 @@ class CronJobManager:
                 timezone=CronJobManager.time_zone,
                 daemon=False)
             self.scheduler.start()
+            self.scheduler.add_job(
+                self.plan_library_refresh,
+                'cron',
+                hour=CronJobManager.start_hour,
+                minute=CronJobManager.start_min
+            )
             CronJobManager.__instance = self
 
     def set_download_path(self, path):
@@ -80,7 +127,8 @@ class CronJobManager:
         self.scheduler.add_job(
             CronJobManager.__instance.cache_user_library,
             args=[user],
-            kwargs={'session': session, 'password': password}
+            kwargs={'session': session, 'password': password},
+            executor=JobPriority.refresh.name
         )
 
     def schedule_user_cache(self, user):
@@ -88,14 +136,35 @@ class CronJobManager:
 
         CronJobManager.logger.info('Scheduling library caching job for ' \
             + 'user %s', user.id)
-        job = self.scheduler.add_job(
-            self.cache_user_library,
-            'interval',
-            args=[user],
-            days=1,
-            start_date=self.update_cron_start_time()
+        CronJobManager.refresh_users[user.id] = user
+
+    def plan_library_refresh(self, users=None):
+        if users == None:
+            self.dmm_ripper.http_client.log_metrics()
+            users = list(CronJobManager.refresh_users.values())
+        if not users:
+            return
+        session = self.db_manager.create_session()
+        refresh_stats = self.db_manager.get_refresh_stats(session,
+            [user.id for user in users])
+        self.db_manager.remove_session()
+        plan, duration = self.refresh_planner.plan(
+            [dict(refresh_stats[user.id], user=user) \
+                for user in users if user.id in refresh_stats],
+            datetime.now(CronJobManager.time_zone)
         )
-        CronJobManager.jobs[user.id] = job
+        CronJobManager.logger.info('Planned the library refresh of %s users, ' \
+            + 'taking %s of DMM requests within a %s window', len(plan),
+            duration, self.refresh_planner.window)
+        for user, run_date in plan:
+            CronJobManager.jobs[user.id] = self.scheduler.add_job(
+                self.cache_user_library,
+                'date',
+                run_date=run_date,
+                args=[user],
+                kwargs={'planned': True},
+                executor=JobPriority.refresh.name
+            )
 
     def add_user_cache_scheduler(self, user, session=None):
         self.update_user_library(user, session)
@@ -103,10 +172,14 @@ class CronJobManager:
 
     @staticmethod
     def remove_scheduled_user_cache(user_id):
+        CronJobManager.refresh_users.pop(user_id, None)
         if user_id in CronJobManager.jobs:
             CronJobManager.logger.info('Removing scheduled library caching ' \
                 + 'job for user %s', user_id)
-            CronJobManager.jobs[user_id].remove()
+            try:
+                CronJobManager.jobs[user_id].remove()
+            except JobLookupError:
+                pass # Already refreshed
             del CronJobManager.jobs[user_id]
 
     @staticmethod
@@ -121,39 +194,204 @@ class CronJobManager:
         return cache_expire_date.replace(tzinfo=None)
 
     @staticmethod
-    def thumbnail(session, db_object, db_manager, parent=None):
-        db_manager.flush(session)
-        if db_object.id:
-            if parent:
-                thumbnail_path = '{}/{}-{}/{}-{}/thumbnail.jpg'.format(
-                    CronJobManager.download_path, 
-                    parent.title,
-                    parent.id, 
-                    db_object.title,
-                    db_object.id
-                )
-            else:
-                thumbnail_path = '{}/{}-{}/thumbnail.jpg'.format(
-                    CronJobManager.download_path, db_object.title, db_object.id
+    def thumbnail(db_object, parent=None):
+        if parent:
+            thumbnail_path = '{}/{}-{}/{}-{}/thumbnail.jpg'.format(
+                CronJobManager.download_path, 
+                parent.title,
+                parent.id, 
+                db_object.title,
+                db_object.id
+            )
+        else:
+            thumbnail_path = '{}/{}-{}/thumbnail.jpg'.format(
+                CronJobManager.download_path, db_object.title, db_object.id
+        )
+        if not utils.dir_exists(thumbnail_path):
+            utils.create_dir(thumbnail_path.rsplit('/', 1)[0])
+            CronJobManager.__instance.dmm_ripper.download_image(
+                db_object.thumbnail_dmm, thumbnail_path
+            )
+            CronJobManager.logger.info('Storing thubnail in %s', 
+                thumbnail_path
+            )
+            db_object.thumbnail_local = thumbnail_path
+
+    def schedule_thumbnails(self, db_objects):
+        series_ids = [db_object.id for db_object in db_objects \
+            if isinstance(db_object, MangaSeries)]
+        volume_ids = [db_object.id for db_object in db_objects \
+            if isinstance(db_object, Manga)]
+        if series_ids or volume_ids:
+            self.scheduler.add_job(
+                CronJobManager.__instance.store_thumbnails_job,
+                args=[series_ids, volume_ids],
+                executor=JobPriority.thumbnail.name
             )
-            if not utils.dir_exists(thumbnail_path):
-                utils.create_dir(thumbnail_path.rsplit('/', 1)[0])
-                CronJobManager.__instance.dmm_ripper.download_image(
-                    db_object.thumbnail_dmm, thumbnail_path
-                )
-                CronJobManager.logger.info('Storing thubnail in %s', 
-                    thumbnail_path
-                )
-                db_object.thumbnail_local = thumbnail_path
-                try:
-                    db_manager.commit(session)
-                except Exception as e:
-                    CronJobManager.logger.exception('Error updating local ' \
-                        + 'thubnail\'s path for: %s', db_object.title)
-                    db_manager.rollback(session)
 
     @staticmethod
-    def cache_user_library(user, session=None, password=None, fast=False):
+    def store_thumbnails_job(series_ids, volume_ids):
+        db_manager = Database.get_instance()
+        db_session = db_manager.create_session()
+        CronJobManager.store_thumbnails(db_manager, db_session,
+            db_manager.get_library_objects(db_session, series_ids, volume_ids)
+        )
+        db_manager.remove_session()
+
+    @staticmethod
+    def store_thumbnails(db_manager, db_session, db_objects):
+        for db_object in db_objects:
+            parent = None
+            if isinstance(db_object, Manga):
+                parent = db_object.serie
+            try:
+                CronJobManager.thumbnail(db_object, parent=parent)
+            except Exception as e:
+                CronJobManager.logger.exception('Error downloading the ' \
+                    + 'thubnail of: %s', db_object.title)
+        try:
+            db_manager.commit(db_session)
+        except Exception as e:
+            CronJobManager.logger.exception('Error updating local ' \
+                + 'thubnails\' paths')
+            db_manager.rollback(db_session)
+
+    @staticmethod
+    def get_cached_dmm_cookies(db_manager, db_session, user):
+        if not user.save_credentials:
+            return None
+        cookies = db_manager.get_user_cookies(db_session, user.id)
+        if cookies:
+            dmm_ripper = CronJobManager.__instance.dmm_ripper
+            if dmm_ripper.is_session_valid(
+                dmm_ripper.get_cookie_session(cookies)):
+
+                CronJobManager.logger.info('Reusing cached DMM session of ' \
+                    + 'user %s', user.id)
+                return cookies
+            CronJobManager.logger.info('Cached DMM session of user %s has ' \
+                + 'expired', user.id)
+            db_manager.remove_user_cookies(db_session, user.id)
+        return None
+
+    @staticmethod
+    def get_user_dmm_session(db_manager, db_session, user, password,
+        fast=False):
+
+        dmm_ripper = CronJobManager.__instance.dmm_ripper
+        cookies = CronJobManager.get_cached_dmm_cookies(
+            db_manager, db_session, user
+        )
+        if cookies:
+            return dmm_ripper.get_cookie_session(cookies)
+        CronJobManager.logger.info('Obtaining a new DMM session for ' \
+            + 'user %s', user.id)
+        session = dmm_ripper.get_session(user.email, password, fast,
+            priority=JobPriority.refresh)
+        if user.save_credentials:
+            db_manager.set_user_cookies(db_session, user.id,
+                dmm_ripper.get_session_cookie_list(session)
+            )
+        return session
+
+    @staticmethod
+    def crawl_user_library(session, books, user_id, index):
+        dmm_ripper = CronJobManager.__instance.dmm_ripper
+        series = [book for book in books if book['series']]
+        CronJobManager.logger.info('Crawling volumes of %s series',
+            len(series))
+        for book, volumes in zip(series,
+            dmm_ripper.get_books_volumes(session, series, user_id=user_id)):
+
+            book['volumes'] = volumes
+
+        unknown_volumes = []
+        for book in books:
+            for volume in book['volumes'] if book['series'] else [book]:
+                volume['details'] = None
+                # Unchanged pages were reconciled by a previous refresh.
+                volume['new'] = volume['changed'] \
+                    and volume['url'] not in index['volumes']
+                if volume['new']:
+                    unknown_volumes.append(volume)
+        CronJobManager.logger.info('Crawling details of %s new volumes',
+            len(unknown_volumes))
+        details = dmm_ripper.get_books_details(session,
+            [volume['details_url'] for volume in unknown_volumes],
+            user_id=user_id
+        )
+        for volume in unknown_volumes:
+            volume['details'] = details[volume['details_url']]
+        return books
+
+    @staticmethod
+    def get_library_entries(user_id, books):
+        dmm_ripper = CronJobManager.__instance.dmm_ripper
+        entries = []
+        for book in books:
+            serie = None
+            volumes = [book]
+            if book['series']:
+                serie = {
+                    'title': book['name'],
+                    'url': book['url'],
+                    'thumbnail_dmm': book['thumbnail']
+                }
+                volumes = book['volumes']
+            for volume in volumes:
+                if not volume['changed']:
+                    continue
+                if volume['new'] and not volume['details']:
+                    CronJobManager.logger.info('Skipping volume without ' \
+                        + 'details: %s', volume['name'])
+                    dmm_ripper.remove_cached_pages(user_id,
+                        volume['cache_keys'])
+                    continue
+                db_volume = {
+                    'title': volume['name'],
+                    'url': volume['url'],
+                    'thumbnail_dmm': volume['thumbnail']
+                }
+                if volume['details']:
+                    db_volume['description'] = volume['details']['description']
+                    db_volume['pages'] = volume['details']['pages']
+                entries.append({
+                    'serie': serie,
+                    'volume': db_volume,
+                    'cache_keys': volume['cache_keys']
+                })
+        return entries
+
+    @staticmethod
+    def is_full_refresh_day(user):
+        # Spreads the weekly full refreshes of the users across the days.
+        full_refresh_days = CronJobManager.scraper_config['FULL_REFRESH_DAYS']
+        today = datetime.now(CronJobManager.time_zone).date()
+        return not user.cache_built \
+            or (today.toordinal() + user.id) % full_refresh_days == 0
+
+    @staticmethod
+    def remove_missing_volumes(db_manager, db_session, user, books):
+        library_urls = set()
+        for book in books:
+            for volume in book['volumes'] if book['series'] else [book]:
+                library_urls.add(volume['url'])
+        if not library_urls:
+            CronJobManager.logger.info('Empty library for user %s, keeping ' \
+                + 'the stored volumes', user.id)
+            return
+        removed_volume_ids = [volume_id for url, volume_id in \
+            db_manager.get_user_volume_urls(db_session, user.id).items() \
+            if url not in library_urls]
+        if removed_volume_ids:
+            db_manager.remove_user_volumes(db_session, user.id,
+                removed_volume_ids)
+            db_session.expire(user, ['book_collection'])
+            LibraryCache.get_instance().invalidate(user.id)
+
+    @staticmethod
+    def cache_user_library(user, session=None, password=None, fast=False,
+        full_refresh=None, planned=False):
         db_manager = Database.get_instance()
         db_session = db_manager.create_session()
         db_manager.set_user_now_caching(db_session, user.id, True)
@@ -163,98 +401,56 @@ class CronJobManager:
             if session == None:
                 if user.save_credentials:
                     password = user.password
-                session = CronJobManager.__instance.dmm_ripper.get_session(
-                    user.email, password, fast)
-                CronJobManager.logger.info('Obtaining a new DMM session for ' \
-                    + 'user %s', user.id)
-            books = CronJobManager.__instance.dmm_ripper.get_purchased_books(
-                session)
+                session = CronJobManager.get_user_dmm_session(
+                    db_manager, db_session, user, password, fast
+                )
+            elif user.save_credentials:
+                db_manager.set_user_cookies(db_session, user.id,
+                    CronJobManager.__instance.dmm_ripper \
+                        .get_session_cookie_list(session)
+                )
+            dmm_ripper = CronJobManager.__instance.dmm_ripper
+            # Planned refreshes share the DMM requests budget, the ones
+            # users asked for run at full speed.
+            if planned:
+                dmm_ripper.http_client.set_refresh_budget(session)
+            if full_refresh == None:
+                full_refresh = CronJobManager.is_full_refresh_day(user)
+            known_urls = None
+            if not full_refresh:
+                known_urls = db_manager.get_user_library_urls(
+                    db_session, user.id
+                )
+            CronJobManager.logger.info('Running %s library refresh for ' \
+                + 'user %s', 'full' if full_refresh else 'incremental',
+                user.id)
+            library = dmm_ripper.get_purchased_library(session,
+                user_id=user.id, known_urls=known_urls)
+            books = library['books']
+            index = db_manager.get_library_index(db_session, user.id)
+            CronJobManager.crawl_user_library(session, books, user.id, index)
             db_session.add(user)
-            for book in books:
-                if book['series']:
-                    serie = db_manager.get_manga_serie(db_session, book['url'])
-                    if not serie:
-                        serie = MangaSeries(
-                            title=book['name'],
-                            url=book['url'], 
-                            thumbnail_dmm=book['thumbnail']
-                        )
-                        db_session.add(serie)
-                        CronJobManager.logger.info('Adding a new serie to DB: '
-                            + '%s', serie.title)
-                        CronJobManager.thumbnail(db_session, serie, db_manager)
-                    CronJobManager.logger.info('Processing volumes of ' \
-                        + 'series %s', serie.title)
-                    volumes = CronJobManager.__instance.dmm_ripper \
-                    .get_book_volumes(
-                        session, book
-                    )
-                    for volume in volumes:
-                        db_volume = db_manager.get_manga_volume(
-                            db_session, volume['url']
-                        )
-                        if not db_volume:
-                            volume_details = CronJobManager.__instance \
-                            .dmm_ripper.get_book_details(
-                                session, volume['details_url']
-                            )
-                            db_volume = Manga(
-                                title=volume['name'],
-                                url=volume['url'],
-                                thumbnail_dmm=volume['thumbnail'],
-                                description=volume_details['description'],
-                                pages=volume_details['pages'],
-                                serie=serie
-                            )
-                            db_session.add(db_volume)
-                            CronJobManager.logger.info('Adding a new volume ' \
-                                + ' to DB: %s', db_volume.title)
-                            CronJobManager.thumbnail(db_session,
-                                db_volume, db_manager, parent=serie
-                            )
-                        if not db_manager.user_owns_volume(db_session,
-                            user.id, db_volume.url):
-                            CronJobManager.logger.info('Adding volume to ' \
-                                + 'user %s', user.id)
-                            try:
-                                user.book_collection.append(db_volume)
-                                db_manager.commit(db_session)
-                            except Exception as e:
-                                CronJobManager.logger.exception('Error ' \
-                                    + 'adding volume to user %s', user.id)
-                                db_manager.rollback(db_session)
-                else:
-                    book = db_manager.get_manga_volume(db_session, book['url'])
-                    if not book:
-                        book_details = CronJobManager.__instance.dmm_ripper \
-                        .get_book_details(
-                            session, book['details_url']
-                        )
-                        book = Manga(
-                            title=book['name'],
-                            url=book['url'],
-                            thumbnail_dmm=book['thumbnail'], 
-                            description=book_details['description'],
-                            pages=book_details['pages'],
-                            serie=serie
-                        )
-                        db_session.add(book)
-                        CronJobManager.logger.info('Adding a new non series ' \
-                            + 'book to DB: %s', book.title)
-                        CronJobManager.thumbnail(db_session, book, db_manager)
-                    if not db_manager.user_owns_volume(db_session, user.id,
-                        book.url):
-                        CronJobManager.logger.info('Adding non series book ' \
-                            + 'to user %s', user.id)
-                        try:
-                            user.book_collection.append(book)
-                            db_manager.commit(session)
-                        except:
-                            CronJobManager.logger.exception('Error adding ' \
-                                + 'non series book to user %s', user.id)
-                            db_manager.rollback(session)
-
+            entries = CronJobManager.get_library_entries(user.id, books)
+            CronJobManager.logger.info('Storing %s changed volumes of user %s',
+                len(entries), user.id)
+            created, failed = db_manager.store_user_volumes(db_session,
+                user.id, entries, index,
+                CronJobManager.scraper_config['WRITE_BATCH_SIZE']
+            )
+            for entry in failed:
+                dmm_ripper.remove_cached_pages(user.id, entry['cache_keys'])
+            db_session.expire(user, ['book_collection'])
+            if entries:
+                LibraryCache.get_instance().invalidate(user.id)
+            CronJobManager.__instance.schedule_thumbnails(created)
 
+            if full_refresh and not library['complete']:
+                CronJobManager.logger.info('Library of user %s not crawled ' \
+                    + 'to its last page, keeping the stored volumes', user.id)
+            elif full_refresh:
+                CronJobManager.remove_missing_volumes(
+                    db_manager, db_session, user, books
+                )
             db_manager.set_user_cache_expire_date(
                 db_session, user.id, CronJobManager.get_cache_expire_date()
             )
@@ -264,6 +460,7 @@ class CronJobManager:
             CronJobManager.logger.info('Unable to login to the DMM account ' \
                 + 'of user %s', user.id)
             db_manager.set_user_login_error(db_session, user.id, True)
+            CronJobManager.__instance.dmm_ripper.clear_user_cache(user.id)
             CronJobManager.remove_scheduled_user_cache(user.id)
             CronJobManager.logger.exception(e)
         finally:
@@ -295,6 +492,10 @@ class CronJobManager:
             CronJobManager.book_job[book.id]['download'].append(
                 {'user': user, 'password': password, 'bot': bot}
             )
+            # Passwords are not saved, resumed jobs use the stored ones.
+            self.db_manager.insert_book_job_subscriber(
+                self.db_manager.create_session(), book.id, user.id
+            )
 
     def subscribe_to_book_conversion(self, book, book_path, user, bot,
         from_download=False):
@@ -321,11 +522,16 @@ class CronJobManager:
                     'bot': bot
                 }
             )
+            self.db_manager.insert_book_job_subscriber(
+                self.db_manager.create_session(), book.id, user.id,
+                file_format=user.file_format
+            )
             if execute_job:
                 self.scheduler.add_job(
                     CronJobManager.__instance.convert_book_job,
                     args=[book_path, book, file_format],
-                    kwargs={'from_download': from_download}
+                    kwargs={'from_download': from_download},
+                    executor=JobPriority.conversion.name
                 )   
 
 
@@ -339,16 +545,22 @@ class CronJobManager:
         update,
         password=None):
 
+        self.db_manager.insert_book_job(
+            self.db_manager.create_session(), book.id
+        )
         self.subscribe_to_book_download(
             book, user, bot, update, password=password
         )
         self.scheduler.add_job(
             CronJobManager.__instance.download_book_pages_job,
-            args=[book_path, missing_images, is_toc_missing, book]
+            args=[book_path, missing_images, is_toc_missing, book],
+            executor=JobPriority.download.name
         )
 
     @staticmethod
-    def get_dmm_cookies_for_book_download(book):
+    def get_dmm_cookies_for_book_download(book, driver):
+        db_manager = Database.get_instance()
+        db_session = db_manager.create_session()
         dmm_cookies = None
         for index, subscriber in enumerate(
             CronJobManager.book_job[book.id]['download']):
@@ -359,14 +571,24 @@ class CronJobManager:
             else:
                 password = user.password
             try:
+                dmm_cookies = CronJobManager.get_cached_dmm_cookies(
+                    db_manager, db_session, user
+                )
+                if dmm_cookies:
+                    driver.add_session_cookies(dmm_cookies)
+                    break
                 CronJobManager.logger.info('Obtaining a new DMM session for ' \
                     + 'subscriber %s', user.id)
                 dmm_cookies = CronJobManager.__instance \
                     .dmm_ripper.get_session_cookies(user.email, password, \
-                        False, remove_cookies=False)
+                        False, remove_cookies=False, driver=driver)
+                if user.save_credentials:
+                    db_manager.set_user_cookies(db_session, user.id,
+                        dmm_cookies
+                    )
                 break
             except Exception as e:
-                CronJobManager.__instance.dmm_ripper.close_session()
+                driver.close_session()
                 CronJobManager.logger.info('Unable to login to the DMM ' \
                     + 'account of subscriber %s. Attempt %s out of %s', 
                     user.id,
@@ -418,6 +640,141 @@ class CronJobManager:
                 )
 
 
+    @staticmethod
+    def get_page_ranges(pages, num_ranges):
+        range_size = int(math.ceil(len(pages) / max(1, num_ranges)))
+        return [pages[index:index + range_size] \
+            for index in range(0, len(pages), max(1, range_size))]
+
+    @staticmethod
+    def lease_capture_drivers(dmm_cookies, num_drivers):
+        dmm_ripper = CronJobManager.__instance.dmm_ripper
+        drivers = []
+        for index in range(num_drivers):
+            try:
+                # Only idle or spawnable webdrivers, never waits for a lease.
+                driver = dmm_ripper.lease_driver(timeout=0)
+            except Exception as e:
+                break
+            try:
+                driver.add_session_cookies(dmm_cookies)
+                drivers.append(driver)
+            except Exception as e:
+                CronJobManager.logger.exception('Unable to load the DMM ' \
+                    + 'session on webdriver %s', driver.worker_id)
+                dmm_ripper.release_driver(driver)
+        return drivers
+
+    @staticmethod
+    def capture_page_range(driver, book, book_path, pages, page_captured,
+        page_stored, preemptible=False):
+
+        dmm_ripper = CronJobManager.__instance.dmm_ripper
+        download_failed = False
+        encodings = []
+        pages_left = []
+        for index, page_num in enumerate(pages):
+            # Borrowed webdrivers go back as soon as a download waits.
+            if preemptible \
+                and dmm_ripper.has_driver_waiters(JobPriority.download):
+
+                CronJobManager.logger.info('Webdriver %s preempted while ' \
+                    + 'capturing book %s', driver.worker_id, book.id)
+                pages_left = pages[index:]
+                break
+            try:
+                encoding = driver.download_book_page(
+                    book, page_num,
+                    path.join(book_path, '{}'.format(page_num)),
+                    page_encoder=CronJobManager.__instance.page_encoder
+                )
+                stored = Future()
+                # Recorded as soon as it is on disk, a crash later in the
+                # range does not lose it.
+                encoding.add_done_callback(
+                    lambda encoding, page_num=page_num, stored=stored: \
+                        CronJobManager.store_page(page_stored, page_num,
+                            encoding, stored)
+                )
+                encodings.append(stored)
+            except:
+                # The next page opens a new reader in the same DMM session.
+                download_failed = True
+            page_captured()
+        driver.close_broser_reader()
+        for stored in encodings:
+            try:
+                stored.result()
+            except Exception as e:
+                CronJobManager.logger.exception('Unable to store a page ' \
+                    + 'of book %s', book.id)
+                download_failed = True
+        return download_failed, pages_left
+
+    @staticmethod
+    def store_page(page_stored, page_num, encoding, stored):
+        try:
+            page_stored(page_num, encoding.result())
+            stored.set_result(page_num)
+        except Exception as e:
+            stored.set_exception(e)
+
+    @staticmethod
+    def capture_borrowed_range(driver, book, book_path, pages, page_captured,
+        page_stored):
+
+        try:
+            return CronJobManager.capture_page_range(driver, book, book_path,
+                pages, page_captured, page_stored, preemptible=True)
+        finally:
+            CronJobManager.__instance.dmm_ripper.release_driver(driver)
+
+    @staticmethod
+    def capture_book_pages(driver, dmm_cookies, book, book_path, pages,
+        page_captured, page_stored):
+
+        webdriver_config = CronJobManager.webdriver_config
+        num_contexts = min(
+            webdriver_config['CAPTURE_CONTEXTS'],
+            len(pages) // webdriver_config['CAPTURE_RANGE_MIN_PAGES']
+        )
+        drivers = [driver]
+        if num_contexts > 1:
+            drivers.extend(CronJobManager.lease_capture_drivers(
+                dmm_cookies, num_contexts - 1
+            ))
+        if len(drivers) == 1:
+            return CronJobManager.capture_page_range(driver, book, book_path,
+                pages, page_captured, page_stored)[0]
+
+        page_ranges = CronJobManager.get_page_ranges(pages, len(drivers))
+        for capture_driver in drivers[len(page_ranges):]:
+            CronJobManager.__instance.dmm_ripper.release_driver(capture_driver)
+        drivers = drivers[:len(page_ranges)]
+        CronJobManager.logger.info('Capturing %s pages of book %s across %s ' \
+            + 'webdrivers', len(pages), book.id, len(page_ranges))
+        with ThreadPoolExecutor(max_workers=len(page_ranges)) as executor:
+            captures = [executor.submit(CronJobManager.capture_page_range,
+                driver, book, book_path, page_ranges[0], page_captured,
+                page_stored)]
+            for capture_driver, page_range in zip(drivers[1:],
+                page_ranges[1:]):
+
+                captures.append(executor.submit(
+                    CronJobManager.capture_borrowed_range, capture_driver,
+                    book, book_path, page_range, page_captured, page_stored
+                ))
+            results = [capture.result() for capture in captures]
+        download_failed = any(failed for failed, _ in results)
+        pages_left = [page_num for _, left in results for page_num in left]
+        if pages_left:
+            CronJobManager.logger.info('Capturing the %s pages of book %s ' \
+                + 'left by preempted webdrivers', len(pages_left), book.id)
+            download_failed = CronJobManager.capture_page_range(driver, book,
+                book_path, pages_left, page_captured, page_stored)[0] \
+                or download_failed
+        return download_failed
+
     @staticmethod
     def download_book_pages_job(
         book_path, missing_images, start_toc_missing, book
@@ -429,6 +786,8 @@ class CronJobManager:
         CronJobManager.logger.info('Starting download job of book %s', book.id)
         db_manager.set_volume_now_downloading(db_session, book.id, True)
         num_missing_images = len(missing_images)
+        db_manager.set_book_job_progress(book.id,
+            book.pages - num_missing_images)
         CronJobManager.notify_subscribers_download_progress(
             book,
             book.pages - num_missing_images,
@@ -436,75 +795,91 @@ class CronJobManager:
             start_toc_missing=start_toc_missing
         )
 
-        dmm_cookies = CronJobManager.get_dmm_cookies_for_book_download(book)
-        download_failed = False
+        driver = CronJobManager.__instance.dmm_ripper.lease_driver()
+        try:
+            dmm_cookies = CronJobManager.get_dmm_cookies_for_book_download(
+                book, driver
+            )
+            download_failed = False
 
-        if dmm_cookies:
-            toc_path = path.join(book_path, 'toc.txt')
-            if start_toc_missing:
-                try:
-                    CronJobManager.__instance.dmm_ripper.download_book_toc( \
-                        book, toc_path)
+            if dmm_cookies:
+                toc_path = path.join(book_path, 'toc.txt')
+                if start_toc_missing:
+                    try:
+                        driver.download_book_toc(book, toc_path)
+                        is_toc_missing = False
+                        CronJobManager.notify_subscribers_download_progress(
+                            book,
+                            book.pages - num_missing_images,
+                            is_toc_missing,
+                            edit_message=True
+                        )
+                    except Exception as e:
+                        CronJobManager.logger.exception(e)
+                        driver.close_broser_reader()
+                        is_toc_missing = True
+                else:
                     is_toc_missing = False
-                    CronJobManager.notify_subscribers_download_progress(
-                        book,
-                        book.pages - num_missing_images,
-                        is_toc_missing,
-                        edit_message=True
-                    )
-                except Exception as e:
-                    CronJobManager.logger.exception(e)
-                    CronJobManager.__instance.dmm_ripper.close_broser_reader()
-                    is_toc_missing = True
-            else:
-                is_toc_missing = False
-            for index, page_num in enumerate(missing_images):
-                try:
-                    CronJobManager.__instance.dmm_ripper.download_book_page( \
-                        book, page_num, \
-                        path.join(book_path, '{}'.format(page_num))
-                    )
-                except:
-                    CronJobManager.__instance.dmm_ripper.close_broser_reader()
-                    download_failed = True
-                CronJobManager.notify_subscribers_download_progress(
-                    book,
-                    book.pages - num_missing_images + index + 1,
-                    is_toc_missing,
-                    start_toc_missing=start_toc_missing,
-                    edit_message=True
-                )
-            CronJobManager.__instance.dmm_ripper.close_broser_reader()
-            CronJobManager.logger.info('Download of book %s has finished',
-                book.id)
-            for subscriber in CronJobManager.book_job[book.id]['download']:
-                user = subscriber['user']
-                subscriber['bot'].send_message(
-                    chat_id=user.id,
-                    text=CronJobManager.lang[user.language_code] \
-                        ['download_finished'].format(
-                            FileFormat(user.file_format).name.upper()
+                progress_lock = threading.Lock()
+                num_captured = [0]
+                def page_captured():
+                    with progress_lock:
+                        num_captured[0] += 1
+                        CronJobManager.notify_subscribers_download_progress(
+                            book,
+                            book.pages - num_missing_images + num_captured[0],
+                            is_toc_missing,
+                            start_toc_missing=start_toc_missing,
+                            edit_message=True
                         )
+                manifest = PageManifest.load(book_path)
+                stored_lock = threading.Lock()
+                num_stored = [0]
+                # The stored progress only counts pages already on disk.
+                def page_stored(page_num, page):
+                    manifest.add_page(page_num, page)
+                    with stored_lock:
+                        num_stored[0] += 1
+                        db_manager.set_book_job_progress(book.id,
+                            book.pages - num_missing_images + num_stored[0])
+                download_failed = CronJobManager.capture_book_pages(
+                    driver, dmm_cookies, book, book_path, missing_images,
+                    page_captured, page_stored
                 )
-                CronJobManager.__instance.subscribe_to_book_conversion( \
-                    book, book_path, subscriber['user'], subscriber['bot'], \
-                    from_download=True
-                )
-        if not dmm_cookies or download_failed:
-            CronJobManager.logger.info('Unable to start the download of ' \
-                + 'book %s', book.id)
-            for subscriber in CronJobManager.book_job[book.id]:
-                user = subscriber['user']
-                CronJobManager.logger.info('Sending download error message ' \
-                    + 'to subscriber %s', user.id)
-                subscriber['bot'].send_message(
-                    chat_id = user.id,
-                    text = CronJobManager.lang[user.language_code] \
-                        ['download_error']
+                CronJobManager.logger.info(
+                    'Download of book %s has finished', book.id
                 )
+                for subscriber in CronJobManager.book_job[book.id]['download']:
+                    user = subscriber['user']
+                    subscriber['bot'].send_message(
+                        chat_id=user.id,
+                        text=CronJobManager.lang[user.language_code] \
+                            ['download_finished'].format(
+                                FileFormat(user.file_format).name.upper()
+                            )
+                    )
+                    CronJobManager.__instance.subscribe_to_book_conversion(
+                        book, book_path, subscriber['user'],
+                        subscriber['bot'], from_download=True
+                    )
+            if not dmm_cookies or download_failed:
+                CronJobManager.logger.info('Unable to start the download ' \
+                    + 'of book %s', book.id)
+                for subscriber in CronJobManager.book_job[book.id]['download']:
+                    user = subscriber['user']
+                    CronJobManager.logger.info('Sending download error ' \
+                        + 'message to subscriber %s', user.id)
+                    subscriber['bot'].send_message(
+                        chat_id = user.id,
+                        text = CronJobManager.lang[user.language_code] \
+                            ['download_error']
+                    )
+        finally:
+            CronJobManager.__instance.dmm_ripper.release_driver(driver)
         db_manager.set_volume_now_downloading(db_session, book.id, False)
         CronJobManager.logger.info('Removing the registration of download ' \
             + 'job for book %s', book.id)
+        db_manager.remove_book_job(db_session, book.id)
         CronJobManager.book_job[book.id]['download'] = []
 
     @staticmethod
@@ -555,12 +930,16 @@ class CronJobManager:
                     document=open(file_format_path, 'rb'),
                     timeout=60
                 )
+        db_manager = Database.get_instance()
+        db_manager.remove_book_job_subscribers(db_manager.create_session(),
+            book.id, file_format)
         CronJobManager.book_job[book.id]['conversion'][file_format] = []
 
     def generante_storage_url(self, file_path, preferred_format, bot, user):
         self.scheduler.add_job(
             CronJobManager.__instance.generante_storage_url_job,
-            args=[file_path, preferred_format, bot, user]
+            args=[file_path, preferred_format, bot, user],
+            executor=JobPriority.conversion.name
         )
     
     @staticmethod
@@ -600,7 +979,7 @@ class CronJobManager:
 
     @staticmethod
     def get_instance(languages=None, max_upload_size=None,
-        webdriver_config=None):
+        webdriver_config=None, scraper_config=None, scheduler_config=None):
 
         if CronJobManager.__instance == None:
             if languages:
@@ -608,22 +987,91 @@ class CronJobManager:
             if max_upload_size:
                 CronJobManager.max_upload_size = max_upload_size
             CronJobManager.webdriver_config = webdriver_config
+            CronJobManager.scraper_config = scraper_config
+            CronJobManager.scheduler_config = scheduler_config
             CronJobManager()
             CronJobManager.logger.info('CronJobManager singleton instanciated')
             session = CronJobManager.__instance.db_manager.create_session()
             CronJobManager.logger.info('Executing unprocessed library ' \
                 + 'caching jobs')
+            expired_users = []
             for user in CronJobManager.__instance.db_manager \
                 .get_credentialed_users(session):
                 
                 if not user.login_error:
-                    if user.cache_expire_date <= datetime.now():
-                        CronJobManager.__instance.update_user_library(user)
-
                     CronJobManager.__instance.schedule_user_cache(user)
+                    if user.cache_expire_date <= datetime.now():
+                        expired_users.append(user)
             CronJobManager.__instance.db_manager.remove_session()
+            # Spread like the nightly refresh instead of all at once.
+            CronJobManager.__instance.plan_library_refresh(expired_users)
 
         return CronJobManager.__instance 
 
+    def resume_book_jobs(self, bot):
+        session = self.db_manager.create_session()
+        # Downloads interrupted by the last shutdown.
+        self.db_manager.reset_volumes_now_downloading(session)
+        subscribers = {}
+        for subscriber in self.db_manager.get_book_job_subscribers(session):
+            subscribers.setdefault(subscriber.volume_id, []).append(subscriber)
+        for book_job in self.db_manager.get_book_jobs(session):
+            book = book_job.volume
+            if book.id not in subscribers:
+                self.db_manager.remove_book_job(session, book.id)
+                continue
+            book_path = utils.get_book_download_path(
+                CronJobManager.download_path, book
+            )
+            utils.create_dir(book_path)
+            missing_images = PageManifest.load(book_path) \
+                .get_missing_pages(book.pages)
+            is_toc_missing = not utils.dir_exists(
+                path.join(book_path, 'toc.txt')
+            )
+            CronJobManager.logger.info('Resuming download job of book %s, ' \
+                + '%s pages missing', book.id, len(missing_images))
+            if book.id not in CronJobManager.book_job:
+                self.register_book_job(book)
+            CronJobManager.book_job[book.id]['download'] = [
+                {'user': subscriber.user, 'password': None, 'bot': bot} \
+                    for subscriber in subscribers[book.id]
+            ]
+            self.scheduler.add_job(
+                CronJobManager.__instance.download_book_pages_job,
+                args=[book_path, missing_images, is_toc_missing, book],
+                executor=JobPriority.download.name
+            )
+        conversions = {}
+        for subscriber in self.db_manager.get_book_job_subscribers(session,
+            conversion=True):
+
+            conversions.setdefault(
+                (subscriber.volume_id, subscriber.file_format), []
+            ).append(subscriber)
+        for (book_id, file_format), format_subscribers in conversions.items():
+            book = format_subscribers[0].volume
+            CronJobManager.logger.info('Resuming %s conversion job of ' \
+                + 'book %s', FileFormat(file_format).name, book_id)
+            if book_id not in CronJobManager.book_job:
+                self.register_book_job(book)
+            CronJobManager.book_job[book_id]['conversion'][file_format] = [
+                {'user': subscriber.user, 'bot': bot} \
+                    for subscriber in format_subscribers
+            ]
+            self.scheduler.add_job(
+                CronJobManager.__instance.convert_book_job,
+                args=[
+                    utils.get_book_download_path(
+                        CronJobManager.download_path, book
+                    ),
+                    book,
+                    file_format
+                ],
+                executor=JobPriority.conversion.name
+            )
+        self.db_manager.remove_session()
+
     def close_dmm_ripper(self):
         self.dmm_ripper.close_driver()
+        self.page_encoder.close()
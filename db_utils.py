@@ -1,17 +1,22 @@
 from sqlalchemy import (Table, Column, ForeignKey, PrimaryKeyConstraint, 
-    Integer, BigInteger, Boolean, TIMESTAMP, String, Enum, func)
+    Integer, BigInteger, Boolean, Float, TIMESTAMP, String, Enum, func, and_,
+    literal, text, union_all)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import (scoped_session, relationship, sessionmaker,
     contains_eager)
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy_utils import force_auto_coercion, EncryptedType
 from constants import FileFormat
 from datetime import datetime
 from data.config import Config
+from contextlib import contextmanager, ExitStack
+import json
 import logging
 import os
 import sys
+import threading
 import utilities as utils
 
 force_auto_coercion()
@@ -24,6 +29,40 @@ user_manga_table = Table('user_manga', Base.metadata,
     PrimaryKeyConstraint('user_id', 'manga_volume_id')
 )
 
+search_min_length = 3 # trigram tokenizer
+
+# Volumes and series share the search table, rowid = id * 2 (+ 1 for series).
+search_index_statements = [
+    'CREATE VIRTUAL TABLE library_search USING fts5(title, description, ' \
+        + 'tokenize=\'trigram\')',
+    'INSERT INTO library_search(rowid, title, description) ' \
+        + 'SELECT id * 2, title, description FROM manga_volume',
+    'INSERT INTO library_search(rowid, title, description) ' \
+        + 'SELECT id * 2 + 1, title, NULL FROM manga_serie'
+]
+
+search_trigger_statements = [
+    'CREATE TRIGGER IF NOT EXISTS manga_volume_search_insert AFTER INSERT ' \
+        + 'ON manga_volume BEGIN INSERT INTO library_search(rowid, title, ' \
+        + 'description) VALUES (new.id * 2, new.title, new.description); END',
+    'CREATE TRIGGER IF NOT EXISTS manga_volume_search_update AFTER UPDATE ' \
+        + 'OF title, description ON manga_volume BEGIN UPDATE ' \
+        + 'library_search SET title = new.title, description = ' \
+        + 'new.description WHERE rowid = old.id * 2; END',
+    'CREATE TRIGGER IF NOT EXISTS manga_volume_search_delete AFTER DELETE ' \
+        + 'ON manga_volume BEGIN DELETE FROM library_search WHERE ' \
+        + 'rowid = old.id * 2; END',
+    'CREATE TRIGGER IF NOT EXISTS manga_serie_search_insert AFTER INSERT ' \
+        + 'ON manga_serie BEGIN INSERT INTO library_search(rowid, title) ' \
+        + 'VALUES (new.id * 2 + 1, new.title); END',
+    'CREATE TRIGGER IF NOT EXISTS manga_serie_search_update AFTER UPDATE ' \
+        + 'OF title ON manga_serie BEGIN UPDATE library_search SET title = ' \
+        + 'new.title WHERE rowid = old.id * 2 + 1; END',
+    'CREATE TRIGGER IF NOT EXISTS manga_serie_search_delete AFTER DELETE ' \
+        + 'ON manga_serie BEGIN DELETE FROM library_search WHERE ' \
+        + 'rowid = old.id * 2 + 1; END'
+]
+
 class User(Base):
     __tablename__ = 'user'
     id = Column(BigInteger, primary_key=True)
@@ -42,6 +81,12 @@ class User(Base):
         'Manga', secondary=lambda: user_manga_table
     )
 
+class UserSession(Base):
+    __tablename__ = 'user_session'
+    user_id = Column(BigInteger, ForeignKey('user.id'), primary_key=True)
+    cookies = Column(EncryptedType(String, Config.SECRET_KEY))
+    update_date = Column(TIMESTAMP(timezone=False), default=datetime.now)
+
 class MangaSeries(Base):
     __tablename__ = 'manga_serie'
     id = Column(Integer, primary_key=True)
@@ -67,9 +112,26 @@ class Manga(Base):
     description = Column(String(5000))
     pages = Column(Integer)
     author_id = Column(Integer, ForeignKey('author.id'))
-    serie_id = Column(Integer, ForeignKey('manga_serie.id'))
+    serie_id = Column(Integer, ForeignKey('manga_serie.id'), index=True)
     now_downloading = Column(Boolean(create_constraint=False), default=False)
 
+class BookJob(Base):
+    __tablename__ = 'book_job'
+    volume_id = Column(Integer, ForeignKey('manga_volume.id'), primary_key=True)
+    pages_captured = Column(Integer, default=0)
+    start_date = Column(TIMESTAMP(timezone=False), default=datetime.now)
+    volume = relationship('Manga')
+
+class BookJobSubscriber(Base):
+    __tablename__ = 'book_job_subscriber'
+    id = Column(Integer, primary_key=True)
+    volume_id = Column(Integer, ForeignKey('manga_volume.id'), index=True)
+    user_id = Column(BigInteger, ForeignKey('user.id'))
+    # Download subscribers have no file format.
+    file_format = Column(Enum(FileFormat))
+    volume = relationship('Manga')
+    user = relationship('User')
+
 class Database():
 
     db_schema_name = Config.DATABASE
@@ -80,17 +142,37 @@ class Database():
         if Database.__instance != None:
             raise Exception("This class is a singleton!")
         else:
-            self.engine = create_engine('sqlite:///{}' \
-                .format(Database.db_schema_name)
-            )
-            if not Database.db_exists():
+            if Database.is_sqlite():
+                self.engine = create_engine(
+                    'sqlite:///{}'.format(Database.db_schema_name),
+                    connect_args={
+                        'timeout': Config.SQLITE['BUSY_TIMEOUT'],
+                        'check_same_thread': False
+                    }
+                )
+                event.listen(self.engine, 'connect',
+                    Database.set_sqlite_pragmas)
+                # SQLite allows a single writer, queue them in the process.
+                self.write_lock = threading.RLock()
+            else:
+                self.engine = create_engine(Database.db_schema_name,
+                    pool_pre_ping=True)
+                self.write_lock = None
+            if Database.is_sqlite() and not Database.db_exists():
                 self.create_schema()
+            else:
+                # Creates the tables added after the schema was built.
+                Base.metadata.create_all(self.engine)
+            self.create_indexes()
+            self.search_enabled = self.create_search_index()
             Base.metadata.bind = self.engine
             self.session_manager = scoped_session(
                 sessionmaker(
                     bind=self.engine, 
                     expire_on_commit=False,
-                    autoflush=True
+                    # Flushes happen only inside writing(), a query would
+                    # otherwise start a write transaction outside the lock.
+                    autoflush=False
                 )
             )
             Database.__instance = self
@@ -102,6 +184,23 @@ class Database():
             Database()
         return Database.__instance
 
+    @staticmethod
+    def is_sqlite():
+        return '://' not in Database.db_schema_name
+
+    @staticmethod
+    def set_sqlite_pragmas(connection, connection_record):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode={}'.format(
+            Config.SQLITE['JOURNAL_MODE']))
+        cursor.execute('PRAGMA synchronous={}'.format(
+            Config.SQLITE['SYNCHRONOUS']))
+        cursor.execute('PRAGMA cache_size={}'.format(
+            Config.SQLITE['CACHE_SIZE']))
+        cursor.execute('PRAGMA mmap_size={}'.format(
+            Config.SQLITE['MMAP_SIZE']))
+        cursor.close()
+
     @staticmethod
     def db_exists():
         return utils.dir_exists(Database.db_schema_name)
@@ -110,6 +209,60 @@ class Database():
         utils.create_dir(Database.db_schema_name.rsplit('/', 1)[0])
         Base.metadata.create_all(self.engine)
 
+    def create_indexes(self):
+        # create_all does not add the indexes of already existing tables.
+        with self.engine.begin() as connection:
+            connection.execute(text('CREATE INDEX IF NOT EXISTS ' \
+                + 'ix_manga_volume_serie_id ON manga_volume (serie_id)'))
+
+    def create_search_index(self):
+        if not Database.is_sqlite():
+            return False
+        try:
+            with self.engine.begin() as connection:
+                if not connection.execute(text('SELECT name FROM ' \
+                    + 'sqlite_master WHERE type = \'table\' AND ' \
+                    + 'name = \'library_search\'')).first():
+
+                    Database.logger.info('Building the library search index')
+                    for statement in search_index_statements:
+                        connection.execute(text(statement))
+                for statement in search_trigger_statements:
+                    connection.execute(text(statement))
+        except OperationalError:
+            Database.logger.exception('SQLite FTS5 trigram tokenizer not ' \
+                + 'available, searching the library with LIKE')
+            return False
+        return True
+
+    def get_search_matches(self, title):
+        terms = title.split()
+        if not self.search_enabled or not terms \
+            or any(len(term) < search_min_length for term in terms):
+
+            return None
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) \
+            for term in terms)
+        # Titles weigh more than descriptions, lower bm25 is better.
+        return text('SELECT rowid, bm25(library_search, 10.0, 1.0) AS rank ' \
+            + 'FROM library_search WHERE library_search MATCH :match') \
+            .bindparams(match=match).columns(rowid=Integer, rank=Float) \
+            .alias('search')
+
+    @contextmanager
+    def writing(self, session):
+        # The whole write unit, from its first flush to the commit, runs
+        # under the lock where there is one. A failed unit is rolled back
+        # before releasing it, no write transaction outlives the lock.
+        with ExitStack() as stack:
+            if self.write_lock != None:
+                stack.enter_context(self.write_lock)
+            try:
+                yield
+            except Exception:
+                session.rollback()
+                raise
+
     def create_session(self):
         return self.session_manager()
 
@@ -130,27 +283,87 @@ class Database():
         library.sort(key=lambda x: x.title)
         return library
 
-    def get_user_library_by_title(self, session, user_id, title):
-        filters = [User.id == user_id, Manga.serie_id == None]
-        if not title.isspace():
-            filters.append(Manga.title.like('%{}%'.format(title)))
-        books = session.query(Manga).join(User.book_collection) \
-            .filter(*filters).all()
-        filters = [User.id == user_id]
-        if not title.isspace():
-            filters.append(MangaSeries.title.like('%{}%'.format(title)))
-        series = session.query(MangaSeries).join(User.book_collection) \
-            .filter(*filters).all()
-        library = books + series
-        library.sort(key=lambda x: x.title)
-        return library
-
-    def get_user_volumes_from_serie(self, session, user_id, series_id, title):
-        filters = [Manga.serie_id == series_id, User.id == user_id]
-        if not title.isspace():
-            filters.append(Manga.title.like('%{}%'.format(title)))
-        return session.query(Manga).join(User.book_collection) \
-            .filter(*filters).order_by(Manga.title).all()
+    def query_series(self, session):
+        # Description of the first volume, resolved in the same statement.
+        description = session.query(Manga.description) \
+            .filter(Manga.serie_id == MangaSeries.id) \
+            .order_by(Manga.id).limit(1).correlate(MangaSeries) \
+            .label('description')
+        return session.query(MangaSeries, description)
+
+    def get_user_library_by_title(self, session, user_id, title, offset=0,
+        limit=None):
+
+        search = self.get_search_matches(title)
+        rank = search.c.rank if search != None else literal(0.0)
+        books = session.query(
+            Manga.id.label('id'),
+            literal(False).label('serie'),
+            Manga.title.label('title'),
+            rank.label('rank')
+        ).join(user_manga_table,
+            user_manga_table.c.manga_volume_id == Manga.id) \
+            .filter(user_manga_table.c.user_id == user_id) \
+            .filter(Manga.serie_id == None)
+        series = session.query(
+            MangaSeries.id, literal(True), MangaSeries.title, rank
+        ).join(Manga, Manga.serie_id == MangaSeries.id) \
+            .join(user_manga_table,
+                user_manga_table.c.manga_volume_id == Manga.id) \
+            .filter(user_manga_table.c.user_id == user_id)
+        if search != None:
+            books = books.join(search, search.c.rowid == Manga.id * 2)
+            series = series.join(search,
+                search.c.rowid == MangaSeries.id * 2 + 1)
+        elif not title.isspace():
+            books = books.filter(Manga.title.like('%{}%'.format(title)))
+            series = series.filter(
+                MangaSeries.title.like('%{}%'.format(title)))
+
+        library = union_all(books.statement, series.distinct().statement) \
+            .alias('library')
+        page = session.query(library.c.id, library.c.serie).order_by(
+            library.c.rank, library.c.title, library.c.serie, library.c.id
+        ).offset(offset)
+        if limit != None:
+            page = page.limit(limit)
+        page = page.all()
+
+        # Loads only the books of the requested page.
+        books = {}
+        book_ids = [book_id for book_id, serie in page if not serie]
+        if book_ids:
+            for book in session.query(Manga).filter(Manga.id.in_(book_ids)):
+                books[(False, book.id)] = book
+        serie_ids = [serie_id for serie_id, serie in page if serie]
+        if serie_ids:
+            for serie, description in self.query_series(session) \
+                .filter(MangaSeries.id.in_(serie_ids)):
+
+                serie.description = description
+                books[(True, serie.id)] = serie
+        return [books[(bool(serie), book_id)] for book_id, serie in page]
+
+    def get_user_volumes_from_serie(self, session, user_id, series_id, title,
+        offset=0, limit=None):
+
+        search = self.get_search_matches(title)
+        volumes = session.query(Manga).join(user_manga_table,
+            user_manga_table.c.manga_volume_id == Manga.id) \
+            .filter(user_manga_table.c.user_id == user_id) \
+            .filter(Manga.serie_id == series_id)
+        if search != None:
+            volumes = volumes.join(search, search.c.rowid == Manga.id * 2) \
+                .order_by(search.c.rank, Manga.title, Manga.id)
+        else:
+            if not title.isspace():
+                volumes = volumes.filter(
+                    Manga.title.like('%{}%'.format(title)))
+            volumes = volumes.order_by(Manga.title, Manga.id)
+        volumes = volumes.offset(offset)
+        if limit != None:
+            volumes = volumes.limit(limit)
+        return volumes.all()
 
     def get_credentialed_users(self, session):
         return session.query(User).filter(User.password != None) \
@@ -159,78 +372,292 @@ class Database():
 
     def insert_user(self, session, user_id):
         Database.logger.info('saving new user %s into DB', user_id)
-        session.add(User(id=user_id))
-        session.commit()
+        with self.writing(session):
+            session.add(User(id=user_id))
+            session.commit()
 
         return self.get_user(session, user_id)
 
     def insert_book_serie(self, session, title, url):
-        session.add(MangaSeries(title=title, url=url))
-        session.commit()
+        with self.writing(session):
+            session.add(MangaSeries(title=title, url=url))
+            session.commit()
 
     def set_user_language(self, session, user_id, language_code):
         Database.logger.info('Updating the language for user %s', user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'language_code': language_code})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'language_code': language_code})
+            session.commit()
 
     def set_user_email(self, session, user_id, email):
         Database.logger.info('Updating the email for user %s', user_id)
-        session.query(User).filter_by(id=user_id).update({'email': email})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id).update({'email': email})
+            session.query(UserSession).filter_by(user_id=user_id).delete()
+            session.commit()
 
     def set_save_credentials(self, session, user_id, save_credentials):
         Database.logger.info('Updating the credential preference for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'save_credentials': save_credentials})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'save_credentials': save_credentials})
+            if not save_credentials:
+                session.query(UserSession).filter_by(user_id=user_id).delete()
+            session.commit()
 
     def set_user_password(self, session, user_id, password):
         Database.logger.info('Updating the password for user %s', user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'password': password})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'password': password})
+            session.query(UserSession).filter_by(user_id=user_id).delete()
+            session.commit()
+
+    def get_user_cookies(self, session, user_id):
+        user_session = session.query(UserSession) \
+            .filter(UserSession.user_id == user_id).first()
+        if user_session and user_session.cookies:
+            return json.loads(user_session.cookies)
+        return None
+
+    def set_user_cookies(self, session, user_id, cookies):
+        Database.logger.info('Updating the DMM session cookies for user %s',
+            user_id)
+        with self.writing(session):
+            session.merge(UserSession(
+                user_id=user_id,
+                cookies=json.dumps(cookies),
+                update_date=datetime.now()
+            ))
+            session.commit()
+
+    def remove_user_cookies(self, session, user_id):
+        Database.logger.info('Removing the DMM session cookies of user %s',
+            user_id)
+        with self.writing(session):
+            session.query(UserSession).filter_by(user_id=user_id).delete()
+            session.commit()
 
     def set_user_file_format(self, session, user_id, file_format):
         Database.logger.info('Updating the file format preference for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'file_format': file_format})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'file_format': file_format})
+            session.commit()
 
     def set_user_cache_expire_date(self, session, user_id, cache_expire_date):
         Database.logger.info('Updating the cache expiration date for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'cache_expire_date': cache_expire_date})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'cache_expire_date': cache_expire_date})
+            session.commit()
+
+    def get_refresh_stats(self, session, user_ids):
+        # Series and the volumes outside of any series, as listed in the
+        # DMM library.
+        return dict(
+            (user_id, {
+                'cache_expire_date': cache_expire_date,
+                'series': series,
+                'volumes': volumes
+            }) for user_id, cache_expire_date, series, volumes \
+                in session.query(
+                    User.id, User.cache_expire_date,
+                    func.count(func.distinct(Manga.serie_id)),
+                    func.count(Manga.id) - func.count(Manga.serie_id)
+                ).outerjoin(user_manga_table,
+                    user_manga_table.c.user_id == User.id) \
+                .outerjoin(Manga,
+                    Manga.id == user_manga_table.c.manga_volume_id) \
+                .filter(User.id.in_(user_ids)).group_by(User.id).all()
+        )
 
     def set_user_now_caching(self, session, user_id, now_caching):
         Database.logger.info('Updating the now caching flag for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'now_caching': now_caching})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'now_caching': now_caching})
+            session.commit()
 
     def set_user_cache_built(self, session, user_id, cache_built):
         Database.logger.info('Updating the cache built flag for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'cache_built': cache_built})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'cache_built': cache_built})
+            session.commit()
 
     def set_user_login_error(self, session, user_id, login_error):
         Database.logger.info('Updating the logging error flag for user %s',
             user_id)
-        session.query(User).filter_by(id=user_id) \
-            .update({'login_error': login_error})
-        session.commit()
+        with self.writing(session):
+            session.query(User).filter_by(id=user_id) \
+                .update({'login_error': login_error})
+            session.commit()
 
     def user_owns_volume(self, session, user_id, url):
         return session.query(Manga).join(User.book_collection) \
             .filter(User.id == user_id).filter(Manga.url == url).first()
 
+    def get_user_library_urls(self, session, user_id):
+        volume_urls = session.query(Manga.url).join(User.book_collection) \
+            .filter(User.id == user_id).filter(Manga.serie_id == None).all()
+        serie_urls = session.query(MangaSeries.url) \
+            .join(Manga, Manga.serie_id == MangaSeries.id) \
+            .join(user_manga_table,
+                user_manga_table.c.manga_volume_id == Manga.id) \
+            .filter(user_manga_table.c.user_id == user_id).distinct().all()
+        return set(url for url, in volume_urls + serie_urls)
+
+    def get_user_volume_urls(self, session, user_id):
+        return dict(session.query(Manga.url, Manga.id) \
+            .join(User.book_collection).filter(User.id == user_id).all())
+
+    def remove_user_volumes(self, session, user_id, volume_ids):
+        Database.logger.info('Removing %s volumes from the library of user %s',
+            len(volume_ids), user_id)
+        with self.writing(session):
+            session.execute(user_manga_table.delete() \
+                .where(user_manga_table.c.user_id == user_id) \
+                .where(user_manga_table.c.manga_volume_id.in_(volume_ids)))
+            session.commit()
+
+    def get_library_index(self, session, user_id):
+        index = {
+            'series': dict(
+                session.query(MangaSeries.url, MangaSeries.id).all()
+            ),
+            'volumes': {},
+            'owned': set()
+        }
+        volumes = session.query(
+            Manga.url, Manga.id, user_manga_table.c.user_id
+        ).outerjoin(user_manga_table, and_(
+            user_manga_table.c.manga_volume_id == Manga.id,
+            user_manga_table.c.user_id == user_id
+        ))
+        for url, volume_id, owner_id in volumes:
+            index['volumes'][url] = volume_id
+            if owner_id != None:
+                index['owned'].add(volume_id)
+        return index
+
+    def reload_library_index(self, session, user_id, index, entries):
+        serie_urls = set(entry['serie']['url'] for entry in entries \
+            if entry['serie'])
+        if serie_urls:
+            index['series'].update(
+                session.query(MangaSeries.url, MangaSeries.id) \
+                    .filter(MangaSeries.url.in_(serie_urls)).all()
+            )
+        volumes = dict(session.query(Manga.url, Manga.id).filter(
+            Manga.url.in_(set(entry['volume']['url'] for entry in entries))
+        ).all())
+        index['volumes'].update(volumes)
+        if volumes:
+            index['owned'].update(volume_id for volume_id, in \
+                session.query(user_manga_table.c.manga_volume_id) \
+                    .filter(user_manga_table.c.user_id == user_id) \
+                    .filter(user_manga_table.c.manga_volume_id.in_(
+                        volumes.values())).all())
+
+    def insert_user_volumes(self, session, user_id, entries, index):
+        created = []
+        series = {}
+        volumes = {}
+        for entry in entries:
+            serie = None
+            serie_id = None
+            if entry['serie']:
+                serie_id = index['series'].get(entry['serie']['url'])
+                serie = series.get(entry['serie']['url'])
+                if serie_id == None and not serie:
+                    serie = MangaSeries(**entry['serie'])
+                    session.add(serie)
+                    series[serie.url] = serie
+                    created.append(serie)
+                    Database.logger.info('Adding a new serie to DB: %s',
+                        serie.title)
+            url = entry['volume']['url']
+            if url not in index['volumes'] and url not in volumes:
+                volume = Manga(**entry['volume'])
+                if serie:
+                    volume.serie = serie
+                else:
+                    volume.serie_id = serie_id
+                session.add(volume)
+                volumes[url] = volume
+                created.append(volume)
+                Database.logger.info('Adding a new volume to DB: %s',
+                    volume.title)
+        session.flush()
+
+        volume_ids = set(
+            index['volumes'].get(entry['volume']['url']) \
+                or volumes[entry['volume']['url']].id for entry in entries
+        )
+        links = [{'user_id': user_id, 'manga_volume_id': volume_id} \
+            for volume_id in volume_ids - index['owned']]
+        if links:
+            Database.logger.info('Adding %s volumes to user %s', len(links),
+                user_id)
+            session.execute(user_manga_table.insert(), links)
+        return created, volume_ids
+
+    def update_library_index(self, index, created, volume_ids):
+        for db_object in created:
+            if isinstance(db_object, MangaSeries):
+                index['series'][db_object.url] = db_object.id
+            else:
+                index['volumes'][db_object.url] = db_object.id
+        index['owned'].update(volume_ids)
+
+    def store_user_volumes(self, session, user_id, entries, index,
+        chunk_size=None):
+
+        created = []
+        failed = []
+        chunk_size = chunk_size or len(entries) or 1
+        for start in range(0, len(entries), chunk_size):
+            chunk = entries[start:start + chunk_size]
+            chunk_created = None
+            with self.writing(session):
+                try:
+                    chunk_created, volume_ids = self.insert_user_volumes(
+                        session, user_id, chunk, index)
+                    session.commit()
+                except Exception:
+                    Database.logger.exception('Error storing %s volumes of ' \
+                        + 'user %s', len(chunk), user_id)
+                    session.rollback()
+                    chunk_created = None
+            if chunk_created != None:
+                self.update_library_index(index, chunk_created, volume_ids)
+                created.extend(chunk_created)
+                continue
+            # Another job may have stored some of these rows meanwhile.
+            self.reload_library_index(session, user_id, index, chunk)
+            for entry in chunk:
+                with self.writing(session):
+                    try:
+                        entry_created, volume_ids = self.insert_user_volumes(
+                            session, user_id, [entry], index)
+                        session.commit()
+                    except Exception:
+                        Database.logger.exception('Error storing volume %s ' \
+                            + 'of user %s', entry['volume']['url'], user_id)
+                        session.rollback()
+                        failed.append(entry)
+                        continue
+                self.update_library_index(index, entry_created, volume_ids)
+                created.extend(entry_created)
+        return created, failed
+
     def get_manga_serie(self, session, url):
         return session.query(MangaSeries).filter(MangaSeries.url == url) \
             .first()
@@ -241,22 +668,101 @@ class Database():
     def get_volume_by_id(self, session, volume_id):
         return session.query(Manga).filter(Manga.id == volume_id).first()
 
+    def get_library_objects(self, session, series_ids, volume_ids):
+        objects = []
+        if series_ids:
+            objects.extend(session.query(MangaSeries) \
+                .filter(MangaSeries.id.in_(series_ids)).all())
+        if volume_ids:
+            objects.extend(session.query(Manga) \
+                .filter(Manga.id.in_(volume_ids)).all())
+        return objects
+
     def set_volume_now_downloading(self, session, volume_id, now_downloading):
         Database.logger.info(
             'Updating the now downloading flag for volume %s', volume_id
         )
-        session.query(Manga).filter_by(id=volume_id) \
-            .update({'now_downloading': now_downloading})
-        session.commit()
+        with self.writing(session):
+            session.query(Manga).filter_by(id=volume_id) \
+                .update({'now_downloading': now_downloading})
+            session.commit()
+
+    def reset_volumes_now_downloading(self, session):
+        with self.writing(session):
+            session.query(Manga).filter(Manga.now_downloading == True) \
+                .update({'now_downloading': False})
+            session.commit()
+
+    def get_book_jobs(self, session):
+        return session.query(BookJob).all()
+
+    def get_book_job_subscribers(self, session, conversion=False):
+        query = session.query(BookJobSubscriber)
+        if conversion:
+            return query.filter(BookJobSubscriber.file_format != None).all()
+        return query.filter(BookJobSubscriber.file_format == None).all()
+
+    def insert_book_job(self, session, volume_id):
+        Database.logger.info('Saving the download job of volume %s', volume_id)
+        with self.writing(session):
+            # A resumed job keeps its progress.
+            if session.query(BookJob).filter_by(volume_id=volume_id) \
+                .first() == None:
+
+                session.add(BookJob(
+                    volume_id=volume_id,
+                    pages_captured=0,
+                    start_date=datetime.now()
+                ))
+                session.commit()
+
+    def set_book_job_progress(self, volume_id, pages_captured):
+        # Called from encoder callbacks, outside any thread's scoped session.
+        session = self.session_manager.session_factory()
+        try:
+            with self.writing(session):
+                session.query(BookJob).filter_by(volume_id=volume_id) \
+                    .update({'pages_captured': pages_captured})
+                session.commit()
+        finally:
+            session.close()
+
+    def remove_book_job(self, session, volume_id):
+        Database.logger.info('Removing the download job of volume %s',
+            volume_id)
+        with self.writing(session):
+            session.query(BookJobSubscriber) \
+                .filter(BookJobSubscriber.volume_id == volume_id) \
+                .filter(BookJobSubscriber.file_format == None) \
+                .delete(synchronize_session=False)
+            session.query(BookJob).filter_by(volume_id=volume_id).delete()
+            session.commit()
+
+    def insert_book_job_subscriber(self, session, volume_id, user_id,
+        file_format=None):
+
+        with self.writing(session):
+            session.add(BookJobSubscriber(
+                volume_id=volume_id,
+                user_id=user_id,
+                file_format=file_format
+            ))
+            session.commit()
+
+    def remove_book_job_subscribers(self, session, volume_id, file_format):
+        with self.writing(session):
+            session.query(BookJobSubscriber) \
+                .filter(BookJobSubscriber.volume_id == volume_id) \
+                .filter(BookJobSubscriber.file_format == file_format) \
+                .delete(synchronize_session=False)
+            session.commit()
 
     def commit(self, session):
-        session.commit()
+        with self.writing(session):
+            session.commit()
 
     def rollback(self, session):
         session.rollback()
 
-    def flush(self, session):
-        session.flush()
-
     def expunge(self, session, object):
         session.expunge(object)
\ No newline at end of file
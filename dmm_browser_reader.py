@@ -1,27 +1,34 @@
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from PIL import Image
+from page_encoder import PageEncoder
 
 
-import io
+import base64
 import logging
 import math
-import time
 
 blank_url = 'about:blank'
+page_timeout = 10
+page_settle_time = 100 #ms
+wait_for_page_script = 'if (!window.dmmReaderHook) { ' \
+    + 'arguments[arguments.length - 1](false); } else { ' \
+    + 'window.dmmReaderHook.waitForPage(arguments[0], arguments[1], ' \
+    + 'arguments[arguments.length - 1]); }'
 
 class DMMBrowserReader():
     logger = logging.getLogger(__name__)
 
-    def __init__(self, driver, book, webdriver_config):
+    def __init__(self, driver, book, webdriver_config, page_encoder=None):
         self.webdriver_config = webdriver_config
+        self.page_encoder = page_encoder
         self.driver = driver
         self.book = book
         self.current_page = None
+        self.capture_canvas = open('./constants/capture_canvas.js', 'r').read()
         self.__open_book_reader(book)
         self.toc_menu_button = (self.driver
             .find_element_by_id('showTableOfContents'))
@@ -44,6 +51,8 @@ class DMMBrowserReader():
             'Opening DMM browser reader for volume %s.' % book.id
         )
         self.driver.get(book.url)
+        reader_hook = open('./constants/reader_hook.js', 'r').read()
+        self.driver.execute_script(reader_hook)
         WebDriverWait(self.driver, 30).until(
             lambda _: (self.driver.find_element_by_id('loaderStatusDialog')
                     .value_of_css_property('display') == 'none' 
@@ -68,7 +77,7 @@ class DMMBrowserReader():
         action.move_to_element(element)
         action.click()
         action.perform()
-        time.sleep(0.5)
+        self.__wait_for_page()
 
     def __press_key(self, key):
         action = ActionChains(self.driver)
@@ -81,7 +90,7 @@ class DMMBrowserReader():
         action.move_by_offset(x_offset, y_offset)
         action.click()
         action.perform()
-        time.sleep(0.5)
+        self.__wait_for_page()
 
     def __is_menu_enabled(self):
         menu = self.driver.find_element_by_id('menu')
@@ -202,17 +211,56 @@ class DMMBrowserReader():
         page_off_input = self.driver.find_element_by_id('animationPattern_off')
         self.__click_element(page_off_input)
 
+    def __get_page_counter(self):
+        return self.page_counter.text
+
+    @staticmethod
+    def __get_page_position(counter):
+        current_page, num_pages = counter.split('/')[:2]
+        return int(current_page), int(num_pages)
+
+    def __wait_for_page(self, previous_counter=None):
+        self.driver.set_script_timeout(page_timeout)
+        try:
+            counter = self.driver.execute_async_script(
+                wait_for_page_script, previous_counter, page_settle_time
+            )
+        except TimeoutException:
+            DMMBrowserReader.logger.info('Page of volume %s not rendered ' \
+                + 'after %s seconds.', self.book.id, page_timeout)
+            counter = self.__get_page_counter()
+        if counter == False:
+            # Hook lost after a reload of the reader, polls instead.
+            WebDriverWait(self.driver, page_timeout).until(
+                lambda _: self.__is_page_ready() and (previous_counter == None
+                    or self.__get_page_counter() != previous_counter)
+            )
+            counter = self.__get_page_counter()
+        if counter:
+            self.current_page = int(counter.split('/')[0])
+
     def __previous_page(self):
+        previous_counter = self.__get_page_counter()
+        self.current_page, _ = \
+            DMMBrowserReader.__get_page_position(previous_counter)
+        # The key does nothing on the first page, no new page to wait for.
+        if self.current_page <= 1:
+            DMMBrowserReader.logger.info('Already on the first page.')
+            return
         DMMBrowserReader.logger.info('Pressing RIGHT key.')
         self.__press_key(Keys.RIGHT)
-        time.sleep(0.25)
-        self.current_page = int(self.page_counter.text.split('/')[0])
+        self.__wait_for_page(previous_counter)
 
     def __next_page(self):
+        previous_counter = self.__get_page_counter()
+        self.current_page, num_pages = \
+            DMMBrowserReader.__get_page_position(previous_counter)
+        if self.current_page >= num_pages:
+            DMMBrowserReader.logger.info('Already on the last page.')
+            return
         DMMBrowserReader.logger.info('Pressing LEFT.')
         self.__press_key(Keys.LEFT)
-        time.sleep(0.25)
-        self.current_page = int(self.page_counter.text.split('/')[0])
+        self.__wait_for_page(previous_counter)
 
     def __move_to_page(self, page):
         if self.__is_dialog_activated():
@@ -242,11 +290,9 @@ class DMMBrowserReader():
                     mov_slider = ('$("#pageSliderBar").slider("value", {});'
                         .format(page_reverse_index)
                     )
+                    previous_counter = self.__get_page_counter()
                     self.driver.execute_script(mov_slider)
-                    time.sleep(0.25)
-                    self.current_page = int(
-                        self.page_counter.text.split('/')[0]
-                    )
+                    self.__wait_for_page(previous_counter)
 
     def __is_dialog_activated(self):
         dialog = self.driver.find_elements_by_xpath(
@@ -257,6 +303,10 @@ class DMMBrowserReader():
         return False
 
     def __is_page_ready(self):
+        ready = self.driver.execute_script('return window.dmmReaderHook ' \
+            + '? window.dmmReaderHook.isReady() : null;')
+        if ready != None:
+            return ready
         loadings = self.driver.find_elements_by_xpath(
             '//div[@class="loading"]'
         )
@@ -270,20 +320,33 @@ class DMMBrowserReader():
             return False
         return True
 
+    def __get_canvas_image(self):
+        try:
+            data_url = self.driver.execute_script(self.capture_canvas)
+        except WebDriverException as e:
+            DMMBrowserReader.logger.info('Unable to read the canvas of ' \
+                + 'page %s: %s', self.current_page, e)
+            return None
+        if not data_url:
+            return None
+        DMMBrowserReader.logger.info(
+            'Saving canvas of page: %s' % self.current_page
+        )
+        return base64.b64decode(data_url.split(',', 1)[1])
+
     def __save_page(self, path):
         WebDriverWait(self.driver, 30).until(
             lambda _: self.__is_page_ready()
         )
         self.__enable_menu(False)
-        png_path = path + '.png'
-        DMMBrowserReader.logger.info(
-            'Saving screenshot of page: %s' % self.current_page
-        )
-        png_img = Image.open(io.BytesIO(self.driver.get_screenshot_as_png()))
-        jpg_img = png_img.convert('RGB')
-        jpg_img.save(
-            path + '.jpg', 'JPEG', optimize=True, progressive=True, quality=85
-        )
+        png_data = self.__get_canvas_image()
+        if png_data == None:
+            DMMBrowserReader.logger.info(
+                'Saving screenshot of page: %s' % self.current_page
+            )
+            png_data = self.driver.get_screenshot_as_png()
+        # Encoded off the driver thread, the next page loads meanwhile.
+        return PageEncoder.encode(png_data, path, self.page_encoder)
 
     def download_page(self, page_num, path, attempt=3):
         self.__move_to_page(page_num)
@@ -295,7 +358,7 @@ class DMMBrowserReader():
             attempt = attempt - 1
         if attempt == 0:
             raise Exception('Page movements attempts exceeded.')
-        self.__save_page(path)
+        return self.__save_page(path)
 
     def download_table_of_contents(self, path):
         DMMBrowserReader.logger.info(
@@ -353,5 +416,5 @@ class DMMBrowserReader():
         toc_file.close()
 
     def close(self):
-        self.driver.delete_all_cookies()
+        # The DMM session stays, a reopened reader captures the next pages.
         self.driver.get(blank_url)
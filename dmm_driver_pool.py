@@ -0,0 +1,303 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from collections import Counter
+from constants import JobPriority
+from contextlib import contextmanager
+from dmm_browser_reader import DMMBrowserReader
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
+from selenium.webdriver.firefox.options import Options
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from urllib.parse import urlparse
+
+import logging
+import queue
+import threading
+import time
+
+blank_url = 'about:blank'
+redirect_url = 'https://www.dmm.com/my/-/redirect/=/rurl='
+driver_timeout = 10
+lease_poll_interval = 1
+
+class DMMDriver():
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, worker_id, webdriver_config):
+        self.worker_id = worker_id
+        self.webdriver_config = webdriver_config
+        firefox_profile = FirefoxProfile()
+        firefox_profile.set_preference(
+            'browser.privatebrowsing.autostart', True
+        )
+        options = Options()
+        options.set_headless(headless=webdriver_config['HEADLESS'])
+
+        self.driver = webdriver.Firefox(firefox_options=options, \
+            executable_path = webdriver_config['GECKO_PATH'])
+        self.driver.set_window_size( \
+            webdriver_config['DRIVER_WINDOW_SIZE'][0], \
+            webdriver_config['DRIVER_WINDOW_SIZE'][1] \
+            + webdriver_config['FIREFOX_HEADER_SIZE']
+        )
+        self.browser_reader = None
+        # Domains holding the cookies of the current DMM session.
+        self.session_domains = set()
+
+    def add_cookies(self, cookies):
+        for cookie in cookies:
+            try:
+                self.driver.add_cookie(cookie)
+            except Exception as e:
+                DMMDriver.logger.info('Unable to add cookie %s to webdriver ' \
+                    + '%s: %s', cookie['name'], self.worker_id, e)
+
+    def add_domain_based_cookies(self, domain, cookies):
+        self.driver.get(domain)
+        self.add_cookies(cookies)
+
+    @staticmethod
+    def get_cookie_domains(cookies):
+        domains = []
+        for cookie in cookies:
+            domain = cookie.get('domain', '').lstrip('.')
+            if domain and domain not in domains:
+                domains.append(domain)
+        return domains
+
+    def add_session_cookies(self, cookies):
+        domains = DMMDriver.get_cookie_domains(cookies)
+        self.session_domains.update(domains)
+        for domain in domains:
+            # Webdriver only accepts cookies for the domain being visited.
+            self.add_domain_based_cookies(
+                'https://{}/'.format(domain),
+                [cookie for cookie in cookies \
+                    if cookie.get('domain', '').lstrip('.') == domain]
+            )
+        self.driver.get(blank_url)
+
+    def remove_cookies(self, cookies):
+        for cookie in cookies:
+            try:
+                self.driver.delete_cookie(cookie['name'])
+            except Exception as i:
+                pass
+
+    def get_session_cookies(self, login_url, email, password,
+        remove_cookies=False):
+
+        self.session_domains.add(urlparse(login_url).hostname)
+        self.driver.get(login_url)
+
+        WebDriverWait(self.driver, driver_timeout).until( \
+            EC.presence_of_element_located((By.ID, 'login_id')))
+        inputElement = self.driver.find_element_by_id('login_id')
+        inputElement.send_keys(email)
+        inputElement = self.driver.find_element_by_id('password')
+        inputElement.send_keys(password)
+
+        login_button = self.driver.find_element_by_xpath( \
+            '//*[@id="loginbutton_script_on"]/span/input' )
+        login_button.submit()
+
+        try:
+            WebDriverWait(self.driver, driver_timeout).until( \
+                lambda x: redirect_url in self.driver.current_url)
+            cookies = self.driver.get_cookies()
+            self.session_domains.add(
+                urlparse(self.driver.current_url).hostname)
+            self.session_domains.update(DMMDriver.get_cookie_domains(cookies))
+            if remove_cookies:
+                self.driver.delete_all_cookies()
+            self.driver.get(blank_url)
+
+            return cookies
+        except TimeoutException:
+            raise Exception('Error: Redirect not happening, ' \
+                'wrong DMM email or password?')
+
+    def close_session(self):
+        # Webdriver only deletes the cookies of the page being visited, the
+        # blank page the driver usually rests on has none.
+        for domain in sorted(self.session_domains):
+            self.driver.get('https://{}/'.format(domain))
+            self.driver.delete_all_cookies()
+        self.session_domains = set()
+        self.driver.get(blank_url)
+
+    def download_book_toc(self, book, path):
+        if self.browser_reader == None:
+            self.browser_reader = DMMBrowserReader(
+                self.driver,
+                book,
+                self.webdriver_config
+            )
+        try:
+            self.browser_reader.download_table_of_contents(path)
+        except Exception as e:
+            DMMDriver.logger.exception(e)
+
+    def download_book_page(self, book, page_num, path, attempts=2,
+        page_encoder=None):
+
+        while attempts > 0:
+            if self.browser_reader == None:
+                self.browser_reader = DMMBrowserReader(
+                    self.driver, book, self.webdriver_config, page_encoder
+                )
+            try:
+                return self.browser_reader.download_page(page_num, path)
+            except Exception as e:
+                DMMDriver.logger.exception(e)
+                # Retried on a reopened reader, still in the DMM session.
+                self.close_broser_reader()
+                attempts = attempts - 1
+        raise Exception('Page downloads attemps exceeded.')
+
+    def close_broser_reader(self):
+        if self.browser_reader:
+            # The reader's own host may have set cookies of the session.
+            self.session_domains.add(
+                urlparse(self.driver.current_url).hostname)
+            self.browser_reader.close()
+            self.browser_reader = None
+
+    def reset(self):
+        self.close_broser_reader()
+        self.close_session()
+
+    def close_driver(self):
+        DMMDriver.logger.info('Closing webdriver %s.', self.worker_id)
+        self.driver.quit()
+
+class DMMDriverPool():
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, webdriver_config):
+        self.webdriver_config = webdriver_config
+        self.size = max(1, webdriver_config['POOL_SIZE'])
+        self.idle_drivers = queue.LifoQueue()
+        self.drivers = []
+        self.num_spawning = 0
+        self.next_worker_id = 0
+        # Leases waiting for a webdriver, by priority.
+        self.waiters = Counter()
+        self.lock = threading.Lock()
+
+    def __spawn_driver(self):
+        with self.lock:
+            if len(self.drivers) + self.num_spawning >= self.size:
+                return None
+            self.num_spawning += 1
+            worker_id = self.next_worker_id
+            self.next_worker_id += 1
+        try:
+            DMMDriverPool.logger.info('Starting webdriver %s, %s out of %s',
+                worker_id, len(self.drivers) + 1, self.size)
+            driver = DMMDriver(worker_id, self.webdriver_config)
+            with self.lock:
+                self.drivers.append(driver)
+            return driver
+        finally:
+            with self.lock:
+                self.num_spawning -= 1
+
+    def is_outranked(self, priority):
+        with self.lock:
+            return any(count for waiter_priority, count in self.waiters.items() \
+                if waiter_priority < priority)
+
+    def has_waiters(self, priority):
+        with self.lock:
+            return any(count for waiter_priority, count in self.waiters.items() \
+                if waiter_priority <= priority)
+
+    def lease(self, timeout=None, priority=JobPriority.download):
+        deadline = None if timeout == None else time.monotonic() + timeout
+        driver = None
+        waiting = False
+        try:
+            while driver == None:
+                # Returned webdrivers go to the most urgent waiters first.
+                if not self.is_outranked(priority):
+                    try:
+                        driver = self.idle_drivers.get_nowait()
+                    except queue.Empty:
+                        driver = self.__spawn_driver()
+                if driver != None:
+                    break
+                wait_time = lease_poll_interval
+                if deadline != None:
+                    wait_time = min(wait_time, deadline - time.monotonic())
+                    if wait_time <= 0:
+                        raise Exception('No webdriver returned to the pool ' \
+                            + 'after {} seconds.'.format(timeout))
+                if not waiting:
+                    DMMDriverPool.logger.info('All %s webdrivers are ' \
+                        + 'leased, waiting for one to be returned.', self.size)
+                    waiting = True
+                    with self.lock:
+                        self.waiters[priority] += 1
+                if self.is_outranked(priority):
+                    time.sleep(wait_time)
+                    continue
+                try:
+                    # Polling lets a waiter spawn a replacement when a
+                    # broken driver is discarded instead of returned.
+                    driver = self.idle_drivers.get(timeout=wait_time)
+                except queue.Empty:
+                    continue
+                # A more urgent lease started waiting while this one was
+                # blocked, it gets the webdriver instead.
+                if self.is_outranked(priority):
+                    self.idle_drivers.put(driver)
+                    driver = None
+        finally:
+            if waiting:
+                with self.lock:
+                    self.waiters[priority] -= 1
+        DMMDriverPool.logger.info('Webdriver %s leased.', driver.worker_id)
+        return driver
+
+    def release(self, driver):
+        try:
+            driver.reset()
+        except Exception as e:
+            DMMDriverPool.logger.exception('Webdriver %s failed to reset, ' \
+                + 'discarding it.', driver.worker_id)
+            self.__discard_driver(driver)
+            return
+        DMMDriverPool.logger.info('Webdriver %s returned.', driver.worker_id)
+        self.idle_drivers.put(driver)
+
+    def __discard_driver(self, driver):
+        with self.lock:
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+        try:
+            driver.close_driver()
+        except Exception:
+            pass
+
+    @contextmanager
+    def leased(self, timeout=None, priority=JobPriority.download):
+        driver = self.lease(timeout, priority)
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        with self.lock:
+            drivers = list(self.drivers)
+            self.drivers = []
+        for driver in drivers:
+            try:
+                driver.close_driver()
+            except Exception as e:
+                DMMDriverPool.logger.exception(e)
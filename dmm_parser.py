@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from bs4 import BeautifulSoup, Comment
+
+import logging
+import re
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = None
+    lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+pages_regex = re.compile(r'^([0-9]+)ページ')
+page_param_regex = re.compile(r'[?&]page=([0-9]+)')
+page_number_regex = re.compile(r'^\s*([0-9]+)\s*$')
+
+# Both parsers read the first non blank text node directly inside an element,
+# text inside child elements and comments is skipped.
+def get_soup_text(element):
+    for text in element.find_all(string=True, recursive=False):
+        if not isinstance(text, Comment) and text.strip():
+            return text.strip()
+    return None
+
+class SoupParser():
+    name = 'html.parser'
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def parse(self, text):
+        return BeautifulSoup(text, 'html.parser')
+
+    def get_books_list(self, soup):
+        books = []
+
+        try:
+            book_list = soup.find('ul', {'class': \
+                'm-boxListBookProductLarge__list'})
+
+            book_divs = book_list.findChildren(attrs={'class': \
+                'm-boxListBookProductBlock__wrap'})
+
+            for book_div in book_divs:
+                try:
+                    book_link = book_div.findChild(attrs={'class': \
+                        'm-boxListBookProductBlock__item'}).findChild()['href']
+                    title_div = book_div.findChild(attrs={'class': \
+                        'm-boxListBookProductBlock__main__info__ttl'})
+                    book_details_url = title_div.findChild()['href']
+                    title = get_soup_text(title_div.findChild())
+                    if title == None:
+                        continue
+
+                    thumbnail = book_div.findChild(
+                        attrs={'class': 'm-boxListBookProductBlock__main__tmb'}
+                    ).findChild('img')['src']
+
+                    url = self.base_url + book_link
+
+                    books.append({
+                        'name': title,
+                        'url': url,
+                        'details_url': book_details_url,
+                        'thumbnail': thumbnail
+                    })
+                except Exception as e:
+                    pass # Book not purchased if book_link missing.
+        except Exception as e:
+            raise Exception('No book found.')
+
+        return books
+
+    def get_last_page(self, soup):
+        last_page = 1
+        pagination = soup.find('ul', {'class': 'm-boxPagenation__list'})
+        if pagination:
+            for item in pagination.findChildren('li',
+                {'class': 'm-boxPagenation__list__item'}):
+
+                pages = page_param_regex.findall(
+                    str(item.findChild('a', href=True) or ''))
+                pages.extend(page_number_regex.findall(item.get_text()))
+                for page in pages:
+                    last_page = max(last_page, int(page))
+        return last_page
+
+    def is_last_volumes_page(self, soup):
+        pagination = soup.find('ul', {'class': 'm-boxPagenation__list'})
+        if not pagination:
+            return None
+        last_soup_page = pagination.findChildren('li',
+            {'class': 'm-boxPagenation__list__item'}
+        )[-1]
+        #if not last page it should contain a link.
+        return last_soup_page.findChild(href=True) == None
+
+    def get_book_details(self, soup):
+        description = get_soup_text(soup.find(
+            'div', {'class': 'm-boxDetailProduct__info__story'}
+        ))
+        product_info = soup.find('div', \
+            {'class': 'm-boxDetailProductInfo'})
+        pages = pages_regex.match(
+            get_soup_text(product_info.findChildren(
+                'dd', \
+                {'class': 'm-boxDetailProductInfo__list__description'}
+            )[2])
+        ).group(1)
+        return {'description': description, 'pages': pages}
+
+def has_class(css_class):
+    return 'contains(concat(" ", normalize-space(@class), " "), " {} ")' \
+        .format(css_class)
+
+class LxmlParser():
+    name = 'lxml'
+
+    if etree:
+        book_list_xpath = etree.XPath('(//ul[{}])[1]'.format(
+            has_class('m-boxListBookProductLarge__list')))
+        book_divs_xpath = etree.XPath('.//*[{}]'.format(
+            has_class('m-boxListBookProductBlock__wrap')))
+        book_link_xpath = etree.XPath('(.//*[{}])[1]/*[1]'.format(
+            has_class('m-boxListBookProductBlock__item')))
+        title_link_xpath = etree.XPath('(.//*[{}])[1]/*[1]'.format(
+            has_class('m-boxListBookProductBlock__main__info__ttl')))
+        thumbnail_xpath = etree.XPath('(.//*[{}])[1]//img[1]'.format(
+            has_class('m-boxListBookProductBlock__main__tmb')))
+        pagination_xpath = etree.XPath('(//ul[{}])[1]'.format(
+            has_class('m-boxPagenation__list')))
+        pagination_items_xpath = etree.XPath('.//li[{}]'.format(
+            has_class('m-boxPagenation__list__item')))
+        pagination_link_xpath = etree.XPath('(.//a[@href])[1]/@href')
+        link_xpath = etree.XPath('.//*[@href]')
+        description_xpath = etree.XPath('(//div[{}])[1]'.format(
+            has_class('m-boxDetailProduct__info__story')))
+        product_info_xpath = etree.XPath('(//div[{}])[1]//dd[{}]'.format(
+            has_class('m-boxDetailProductInfo'),
+            has_class('m-boxDetailProductInfo__list__description')))
+        text_xpath = etree.XPath('text()[normalize-space()][1]')
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def parse(self, text):
+        return lxml_html.document_fromstring(text)
+
+    @staticmethod
+    def get_text(element):
+        texts = LxmlParser.text_xpath(element)
+        return texts[0].strip() if texts else None
+
+    def get_books_list(self, document):
+        books = []
+
+        book_list = LxmlParser.book_list_xpath(document)
+        if not book_list:
+            raise Exception('No book found.')
+
+        for book_div in LxmlParser.book_divs_xpath(book_list[0]):
+            try:
+                book_link = LxmlParser.book_link_xpath(book_div)[0] \
+                    .attrib['href']
+                title_link = LxmlParser.title_link_xpath(book_div)[0]
+                book_details_url = title_link.attrib['href']
+                title = LxmlParser.get_text(title_link)
+                if title == None:
+                    continue
+                thumbnail = LxmlParser.thumbnail_xpath(book_div)[0] \
+                    .attrib['src']
+
+                books.append({
+                    'name': title,
+                    'url': self.base_url + book_link,
+                    'details_url': book_details_url,
+                    'thumbnail': thumbnail
+                })
+            except (IndexError, KeyError):
+                pass # Book not purchased if book_link missing.
+
+        return books
+
+    def get_last_page(self, document):
+        last_page = 1
+        pagination = LxmlParser.pagination_xpath(document)
+        if pagination:
+            for item in LxmlParser.pagination_items_xpath(pagination[0]):
+                pages = []
+                for link in LxmlParser.pagination_link_xpath(item):
+                    pages.extend(page_param_regex.findall(link))
+                pages.extend(page_number_regex.findall(item.text_content()))
+                for page in pages:
+                    last_page = max(last_page, int(page))
+        return last_page
+
+    def is_last_volumes_page(self, document):
+        pagination = LxmlParser.pagination_xpath(document)
+        if not pagination:
+            return None
+        last_page_item = LxmlParser.pagination_items_xpath(pagination[0])[-1]
+        #if not last page it should contain a link.
+        return not LxmlParser.link_xpath(last_page_item)
+
+    def get_book_details(self, document):
+        description = LxmlParser.get_text(
+            LxmlParser.description_xpath(document)[0])
+        pages = pages_regex.match(
+            LxmlParser.get_text(LxmlParser.product_info_xpath(document)[2])
+        ).group(1)
+        return {'description': description, 'pages': pages}
+
+parsers = {SoupParser.name: SoupParser, LxmlParser.name: LxmlParser}
+
+def get_parser(name, base_url):
+    if name == LxmlParser.name and lxml_html == None:
+        logger.info('lxml is not available, falling back to %s',
+            SoupParser.name)
+        name = SoupParser.name
+    return parsers[name](base_url)
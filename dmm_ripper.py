@@ -2,81 +2,62 @@
 # -*-coding:utf-8 -*-
 
 from bs4 import BeautifulSoup
-from dmm_browser_reader import DMMBrowserReader
-from selenium import webdriver
-from selenium.webdriver.common.alert import Alert
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.firefox.firefox_profile import FirefoxProfile
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-
+from concurrent.futures import ThreadPoolExecutor
+from constants import JobPriority
+from dmm_driver_pool import DMMDriverPool, redirect_url
+from http_cache import HTTPCache
+from http_client import HTTPClient
+from urllib.parse import urljoin
+
+import dmm_parser
 import logging
 import os
-import re
 import requests
 import sys
-import utilities
 
-blank_url = 'about:blank'
-redirect_url = 'https://www.dmm.com/my/-/redirect/=/rurl='
 book_url = 'https://book.dmm.com'
 library_url = book_url + '/library/'
-driver_timeout = 10
+session_check_timeout = 10
 
 class DMMRipper():
     logger = logging.getLogger(__name__)
     __instance = None
 
-    def __init__(self, webdriver_config=None):
+    def __init__(self, webdriver_config=None, scraper_config=None):
         if DMMRipper.__instance != None:
             raise Exception('This class is a singleton!')
         else:
             self.webdriver_config = webdriver_config
-            firefox_profile = FirefoxProfile()
-            firefox_profile.set_preference(
-                'browser.privatebrowsing.autostart', True
-            )
-            options = Options()
-            options.set_headless(headless=webdriver_config['HEADLESS'])
-
-            self.driver = webdriver.Firefox(firefox_options=options, \
-                executable_path = webdriver_config['GECKO_PATH'])
-            self.driver.set_window_size( \
-                webdriver_config['DRIVER_WINDOW_SIZE'][0], \
-                webdriver_config['DRIVER_WINDOW_SIZE'][1] \
-                + webdriver_config['FIREFOX_HEADER_SIZE']
+            self.scraper_config = scraper_config
+            self.parser = dmm_parser.get_parser(
+                scraper_config['PARSER'] if scraper_config \
+                    else dmm_parser.SoupParser.name,
+                book_url
             )
-            self.browser_reader = None
+            self.http_cache = None
+            if scraper_config and scraper_config['HTTP_CACHE_PATH']:
+                self.http_cache = HTTPCache(
+                    scraper_config['HTTP_CACHE_PATH']
+                )
+            self.http_client = HTTPClient.get_instance()
+            self.driver_pool = DMMDriverPool(webdriver_config)
             DMMRipper.__instance = self
 
     @staticmethod
-    def get_instance(webdriver_config=None):
+    def get_instance(webdriver_config=None, scraper_config=None):
         if DMMRipper.__instance == None:
             DMMRipper.logger.info('DMMRipper singleton instantiated')
-            DMMRipper(webdriver_config)
+            DMMRipper(webdriver_config, scraper_config)
         return DMMRipper.__instance
 
-    def add_cookies(self, cookies):
-        for cookie in cookies:
-            try:
-                self.driver.add_cookie(cookie)
-            except Exception as e:
-                print(e)
+    def lease_driver(self, timeout=None, priority=JobPriority.download):
+        return self.driver_pool.lease(timeout, priority)
 
-    def add_domain_based_cookies(self, domain, cookies):
-        self.driver.get(domain)
-        self.add_cookies(cookies)
+    def has_driver_waiters(self, priority):
+        return self.driver_pool.has_waiters(priority)
 
-    def remove_cookies(self, cookies):
-        for cookie in cookies:
-            try:
-                self.driver.delete_cookie(cookie['name'])
-            except Exception as i:
-                pass
+    def release_driver(self, driver):
+        self.driver_pool.release(driver)
 
     def get_login_url(self, fast):
         login_url = 'https://www.dmm.com/my/-/login/' \
@@ -85,7 +66,7 @@ class DMMRipper():
         if fast:
             return login_url
         else:
-            response = requests.get(book_url)
+            response = self.http_client.get(book_url, endpoint='top page')
             soup = BeautifulSoup(response.text, 'html.parser')
             try:
                 return soup.find('a', attrs={'class': 'hd-btn--login'}) \
@@ -94,135 +75,323 @@ class DMMRipper():
                 return login_url
 
     def get_session_cookies(self, email, password, fast=False,
-        remove_cookies=False):
-        
-        login_url = self.get_login_url(fast)
-        self.driver.get(login_url)
-
-        WebDriverWait(self.driver, driver_timeout).until( \
-            EC.presence_of_element_located((By.ID, 'login_id')))
-        inputElement = self.driver.find_element_by_id('login_id')
-        inputElement.send_keys(email)
-        inputElement = self.driver.find_element_by_id('password')
-        inputElement.send_keys(password)
-
-        login_button = self.driver.find_element_by_xpath( \
-            '//*[@id="loginbutton_script_on"]/span/input' )
-        login_button.submit()
+        remove_cookies=False, driver=None, priority=JobPriority.download):
 
-        try:
-            WebDriverWait(self.driver, driver_timeout).until( \
-                lambda x: redirect_url in self.driver.current_url)
-            cookies = self.driver.get_cookies()
-            if remove_cookies:
-                self.driver.delete_all_cookies()
-            self.driver.get(blank_url)
-
-            return cookies
-        except TimeoutException:
+        login_url = self.get_login_url(fast)
+        if driver:
+            return driver.get_session_cookies(login_url, email, password,
+                remove_cookies=remove_cookies)
+        with self.driver_pool.leased(priority=priority) as driver:
+            return driver.get_session_cookies(login_url, email, password,
+                remove_cookies=remove_cookies)
+
+    def get_login_form_data(self, soup, email, password):
+        login_input = soup.find('input', {'id': 'login_id'})
+        password_input = soup.find('input', {'id': 'password'})
+        if not login_input or not password_input:
+            raise Exception('Login form not found.')
+        form = login_input.find_parent('form')
+
+        form_data = {}
+        for form_input in form.find_all('input'):
+            name = form_input.get('name')
+            input_type = form_input.get('type', 'text').lower()
+            if not name or input_type in ('submit', 'button', 'image'):
+                continue
+            if input_type in ('checkbox', 'radio'):
+                if form_input.has_attr('checked'):
+                    form_data[name] = form_input.get('value', 'on')
+                continue
+            form_data[name] = form_input.get('value', '')
+        form_data[login_input['name']] = email
+        form_data[password_input['name']] = password
+
+        return form.get('action'), form_data
+
+    def is_login_response(self, response):
+        for redirect in response.history + [response]:
+            if redirect_url in redirect.url:
+                return True
+        return False
+
+    def get_http_session(self, email, password, fast=False):
+        session = self.http_client.create_session()
+        login_url = self.get_login_url(fast)
+        response = self.http_client.get(login_url, session=session,
+            endpoint='login form')
+        if response.status_code != 200:
+            raise Exception('Unable to obtain the DMM login form.')
+
+        action, form_data = self.get_login_form_data(
+            BeautifulSoup(response.text, 'html.parser'), email, password
+        )
+        response = self.http_client.post(
+            urljoin(response.url, action or response.url),
+            session=session,
+            endpoint='login',
+            max_attempts=1,
+            data=form_data,
+            headers={'Referer': response.url}
+        )
+        if not self.is_login_response(response):
             raise Exception('Error: Redirect not happening, ' \
                 'wrong DMM email or password?')
+        return session
+
+    def get_session(self, email, password, fast=False, http_login=True,
+        priority=JobPriority.download):
 
-    def get_session(self, email, password, fast=False):
-        cookies = self.get_session_cookies(email, password, fast)
-        session = requests.Session()
+        if http_login:
+            try:
+                return self.get_http_session(email, password, fast)
+            except Exception as e:
+                DMMRipper.logger.info('HTTP login failed, falling back to ' \
+                    + 'webdriver login: %s', e)
+        cookies = self.get_session_cookies(email, password, fast,
+            priority=priority)
+        return self.get_cookie_session(cookies)
+
+    def get_cookie_session(self, cookies):
+        session = self.http_client.create_session()
         for cookie in cookies:
-            session.cookies.set(cookie['name'], cookie['value'])
+            session.cookies.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie.get('domain', ''),
+                path=cookie.get('path', '/')
+            )
         return session
 
-    def close_session(self):
-        self.driver.delete_all_cookies()
+    def get_session_cookie_list(self, session):
+        cookies = []
+        for cookie in session.cookies:
+            cookie_dict = {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': bool(cookie.secure)
+            }
+            if cookie.expires:
+                cookie_dict['expiry'] = cookie.expires
+            cookies.append(cookie_dict)
+        return cookies
+
+    def is_session_valid(self, session):
+        try:
+            # An expired session is redirected to the login form.
+            response = self.http_client.get(library_url, session=session,
+                endpoint='session check', max_attempts=1,
+                allow_redirects=False, timeout=session_check_timeout)
+        except requests.RequestException as e:
+            DMMRipper.logger.info('Unable to check DMM session: %s', e)
+            return False
+        return response.status_code == 200
 
     def close_driver(self):
-        DMMRipper.logger.info('Closing webdriver.')
-        self.driver.quit()
+        DMMRipper.logger.info('Closing webdriver pool.')
+        self.driver_pool.close()
+
+    def get_books_list(self, document):
+        return self.parser.get_books_list(document)
+
+    def request_page(self, session, url, page, description, max_attempts=5,
+        headers=None):
+
+        endpoint = description
+        params = None
+        if page != None:
+            params = {'page': page}
+            description = 'page {} of {}'.format(page, description)
+        # Connection errors, 5xx and 429 are retried by the HTTP client.
+        response = self.http_client.get(url, session=session,
+            endpoint=endpoint, max_attempts=max_attempts, params=params,
+            headers=headers)
+        if response.status_code in (200, 304):
+            DMMRipper.logger.info('Successfully requested %s', description)
+            return response
+        raise Exception('Unable to obtain {}, status {}.'.format(
+            description, response.status_code))
+
+    def get_cache_key(self, url, page=None):
+        if page == None:
+            return url
+        return '{}?page={}'.format(url, page)
+
+    def fetch_page(self, session, url, page, description, parse,
+        max_attempts=5, user_id=None):
+
+        use_cache = self.http_cache != None and user_id != None
+        cache_key = self.get_cache_key(url, page)
+        entry = None
+        headers = {}
+        if use_cache:
+            entry = self.http_cache.get(user_id, cache_key)
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.request_page(session, url, page, description,
+            max_attempts, headers=headers)
+        if response.status_code == 304:
+            if not entry:
+                raise Exception('Not modified response without a cached ' \
+                    + 'entry for {}.'.format(cache_key))
+            DMMRipper.logger.info('%s not modified since last request',
+                cache_key)
+            return entry['data'], False
+
+        content_hash = None
+        if use_cache:
+            content_hash = HTTPCache.get_content_hash(response.text)
+            if entry and entry['content_hash'] == content_hash:
+                DMMRipper.logger.info('%s content unchanged since last ' \
+                    + 'request', cache_key)
+                return entry['data'], False
+
+        data = parse(self.parser.parse(response.text))
+        if use_cache:
+            self.http_cache.set(user_id, cache_key, data, content_hash,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+        return data, True
 
-    def get_books_list(self, soup):
-        books = []
+    def remove_cached_pages(self, user_id, cache_keys):
+        if self.http_cache:
+            for cache_key in cache_keys:
+                self.http_cache.remove(user_id, cache_key)
+
+    def clear_user_cache(self, user_id):
+        if self.http_cache:
+            self.http_cache.remove_user(user_id)
 
+    def parse_library_page(self, document):
         try:
-            book_list = soup.find('ul', {'class': \
-                'm-boxListBookProductLarge__list'})
-
-            book_divs = book_list.findChildren(attrs={'class': \
-                'm-boxListBookProductBlock__wrap'})
-
-            for book_div in book_divs:
-                try:
-                    book_link = book_div.findChild(attrs={'class': \
-                        'm-boxListBookProductBlock__item'}).findChild()['href']
-                    title_div = book_div.findChild(attrs={'class': \
-                        'm-boxListBookProductBlock__main__info__ttl'})
-                    book_details_url = title_div.findChild()['href']
-                    title = title_div.findChild().contents[0]
-
-                    thumbnail = book_div.findChild(
-                        attrs={'class': 'm-boxListBookProductBlock__main__tmb'}
-                    ).findChild('img')['src']
-
-                    url = book_url + book_link
-
-                    books.append({
-                        'name': title,
-                        'url': url,
-                        'details_url': book_details_url,
-                        'thumbnail': thumbnail
-                    })
-                except Exception as e:
-                    pass # Book not purchased if book_link missing.
-        except Exception as e:
-            raise Exception('No book found.')
-
-        return books
-
-    def get_purchased_books(self, session, max_attempts=5):
+            books = self.parser.get_books_list(document)
+        except Exception:
+            books = None
+        return {
+            'books': books,
+            'last_page': self.parser.get_last_page(document)
+        }
+
+    def get_library_page(self, session, page, max_attempts=5, user_id=None):
+        library_page, changed = self.fetch_page(session, library_url, page,
+            'purchased books', self.parse_library_page, max_attempts, user_id)
+        for book in library_page['books'] or []:
+            book['changed'] = changed
+            book['cache_keys'] = [self.get_cache_key(library_url, page)]
+        return library_page
+
+    def is_known_library_page(self, books, known_urls):
+        if known_urls == None:
+            return False
+        return all(book['url'] in known_urls for book in books)
+
+    def get_purchased_library(self, session, max_attempts=5, concurrent=None,
+        user_id=None, known_urls=None):
+
+        if concurrent == None:
+            concurrent = self.scraper_config['CONCURRENT_PAGES']
         books = []
         library_end = False
+        incremental_end = False
         page = 1
-        error = False
-        attempt_num = 0
 
+        # The library is ordered newest first, so an incremental refresh
+        # walks it page by page until a page without new books.
+        if concurrent and known_urls == None:
+            library_page = self.get_library_page(session, page, max_attempts,
+                user_id)
+            last_page = library_page['last_page']
+            if library_page['books'] != None:
+                books.extend(library_page['books'])
+                page += 1
+            else:
+                DMMRipper.logger.info('Purchased book library ended')
+                library_end = True
+            if not library_end and last_page >= page:
+                DMMRipper.logger.info('Requesting pages %d to %d of ' \
+                    'purchased books concurrently', page, last_page)
+                with ThreadPoolExecutor(max_workers=min(
+                    self.scraper_config['MAX_WORKERS'], last_page - 1)) \
+                    as executor:
+
+                    library_pages = list(executor.map(
+                        lambda page: self.get_library_page(
+                            session, page, max_attempts, user_id
+                        ),
+                        range(page, last_page + 1)
+                    ))
+                    for library_page in library_pages:
+                        if library_end:
+                            continue
+                        if library_page['books'] != None:
+                            books.extend(library_page['books'])
+                            page += 1
+                        else:
+                            DMMRipper.logger.info('Purchased book library ' \
+                                'ended')
+                            library_end = True
+                    last_page = max([last_page] + [library_page['last_page'] \
+                        for library_page in library_pages])
+        else:
+            last_page = 1
+
+        # Pages past the paginated range are still probed one by one.
         while not library_end:
-            while (not attempt_num) or (error and attempt_num < max_attempts):
-                response = requests.get(library_url,
-                    params={'page': page},
-                    cookies=session.cookies.get_dict()
-                )
-                if response.status_code == 200:
-                    DMMRipper.logger.info('Successfully requested page %d ' \
-                        'of purchased books', page)
-                    try:
-                        books.extend(self.get_books_list(
-                            BeautifulSoup(response.text, 'html.parser'))
-                        )
-                        page += 1
-                        error = False
-                        attempt_num = 0
-                    except:
-                        DMMRipper.logger.info('Purchased book library ended')
-                        library_end = True
-                        break
-                else:
-                    DMMRipper.logger.info('Failed to obtain response for '
-                        + 'page {} of purchased books, attempt {} out of {}' \
-                        .format(
-                            page, attempt_num + 1, max_attempts
-                        )
-                    )
-                    error = True
-                    attempt_num += 1
-
-        if error:
-            raise Exception('Unable to obtain all the purchased books.')
-            
+            library_page = self.get_library_page(session, page, max_attempts,
+                user_id)
+            last_page = max(last_page, library_page['last_page'])
+            if library_page['books'] != None:
+                books.extend(library_page['books'])
+                if self.is_known_library_page(library_page['books'],
+                    known_urls):
+
+                    DMMRipper.logger.info('Page %d of purchased books has ' \
+                        'no new books, incremental refresh ended', page)
+                    library_end = True
+                    incremental_end = True
+                page += 1
+            else:
+                DMMRipper.logger.info('Purchased book library ended')
+                library_end = True
+
         for book in books:
             book['series'] = False
             if 'series' in book['url']:
                 book['series'] = True
-        
-        return books
 
-    def get_book_volumes(self, session, book, max_attempts=5):
+        # Complete when every page up to the last one of the pagination
+        # parsed, an unparsable page inside it ends the crawl early.
+        complete = not incremental_end and page > last_page
+        if not complete and not incremental_end:
+            DMMRipper.logger.info('Purchased books crawl stopped at page %d ' \
+                'out of %d', page, last_page)
+        return {'books': books, 'complete': complete}
+
+    def get_purchased_books(self, session, max_attempts=5, concurrent=None,
+        user_id=None, known_urls=None):
+
+        return self.get_purchased_library(session, max_attempts, concurrent,
+            user_id, known_urls)['books']
+
+    def parse_volumes_page(self, document):
+        try:
+            volumes = self.parser.get_books_list(document)
+        except Exception:
+            raise Exception('Unable to obtain all the volumes in series')
+        last_page = self.parser.is_last_volumes_page(document)
+        if last_page == None:
+            DMMRipper.logger.info('Pagination system incompatible, ' \
+                + 'assuming single page series.')
+            last_page = True
+        return {'volumes': volumes, 'last_page': last_page}
+
+    def get_book_volumes(self, session, book, max_attempts=5, user_id=None):
         volumes = []
         if 'series' not in book:
             volumes.append(dict(book))
@@ -230,129 +399,68 @@ class DMMRipper():
         else:
             last_page = False
             page = 1
-            error = False
-            attempt_num = 0
             while not last_page:
-                while (error and attempt_num < max_attempts) \
-                    or (not attempt_num):
-                    
-                    response = requests.get(book['url'],
-                        params={'page': page},
-                        cookies=session.cookies.get_dict()
-                    )
-                    if response.status_code == 200:
-                        DMMRipper.logger.info('Successfully requested page ' \
-                            '%d of volumes of series', page)
-                        soup = BeautifulSoup(response.text, 'html.parser')
-                        try:
-                            pagination = soup.find('ul', 
-                                {'class': 'm-boxPagenation__list'}
-                            )
-                            last_soup_page = pagination.findChildren('li',
-                                {'class': 'm-boxPagenation__list__item'}
-                            )[-1]
-                            try:
-                                volumes.extend(self.get_books_list(soup))
-                            except Exception:
-                                raise Exception('Unable to obtain all the ' \
-                                    + 'volumes in series')
-                            try:
-                                #if not last page it should contain a link.
-                                last_soup_page.findChild()['href']
-                                page += 1
-                                error = False
-                                attempt_num = 0
-                            except:
-                                last_page = True
-                                break
-                        except:
-                            DMMRipper.logger.exception('Pagination system ' \
-                                + 'incompatible.')
-                    else:
-                        DMMRipper.logger.info('Failed to obtain response for ' \
-                            + 'page {} of volumes of series, attempt {} out ' \
-                            + 'of {}'.format(
-                                page, attempt_num + 1, max_attempts
-                            )
-                        )
-                        error = True
-                        attempt_num += 1
-
-            if error:
-                raise Exception('Unable to obtain all the volumes in series.')
+                volumes_page, changed = self.fetch_page(session, book['url'],
+                    page, 'volumes of series', self.parse_volumes_page,
+                    max_attempts, user_id)
+                for volume in volumes_page['volumes']:
+                    volume['changed'] = changed
+                    volume['cache_keys'] = [
+                        self.get_cache_key(book['url'], page)
+                    ]
+                volumes.extend(volumes_page['volumes'])
+                last_page = volumes_page['last_page']
+                page += 1
 
         return list(reversed(volumes))
 
-    def get_book_details(self, session, details_url):
+    def get_books_volumes(self, session, books, max_attempts=5, user_id=None):
+        with ThreadPoolExecutor(
+            max_workers=self.scraper_config['MAX_WORKERS']) as executor:
+
+            return list(executor.map(
+                lambda book: self.get_book_volumes(
+                    session, book, max_attempts, user_id
+                ),
+                books
+            ))
+
+    def get_book_details(self, session, details_url, user_id=None):
         details = None
         try:
-            response = requests.get(details_url, \
-                cookies=session.cookies.get_dict())
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                description = soup.find(
-                    'div', {'class': 'm-boxDetailProduct__info__story'}
-                ).contents[0].strip()
-                product_info = soup.find('div', \
-                    {'class': 'm-boxDetailProductInfo'})
-                pages = re.match(
-                    r'^([0-9]+)ページ', 
-                    product_info.findChildren(
-                        'dd', \
-                        {'class': 'm-boxDetailProductInfo__list__description'}
-                    )[2].contents[0].strip()
-                ).group(1) 
-                details = {'description': description, 'pages': pages}
-        except Exception as e:
-            print(e)
+            details, changed = self.fetch_page(session, details_url, None,
+                'book details', self.parser.get_book_details,
+                user_id=user_id)
+        except Exception:
+            DMMRipper.logger.exception('Error getting the book details of %s',
+                details_url)
         return details
 
+    def get_books_details(self, session, details_urls, user_id=None):
+        details_urls = list(dict.fromkeys(details_urls))
+        with ThreadPoolExecutor(
+            max_workers=self.scraper_config['MAX_WORKERS']) as executor:
+
+            return dict(zip(details_urls, executor.map(
+                lambda details_url: self.get_book_details(
+                    session, details_url, user_id
+                ),
+                details_urls
+            )))
+
     def download_image(self, url, path):
-     response = requests.get(url, stream=True)
+     response = self.http_client.get(url, endpoint='thumbnail', stream=True)
      if response.status_code == 200:
          with open(path, 'wb') as f:
              for chunk in response.iter_content(chunk_size=1024):
                  f.write(chunk)
 
-    def download_book_toc(self, book, path):
-        if self.browser_reader == None:
-            self.browser_reader = DMMBrowserReader(
-                self.driver,
-                book,
-                self.webdriver_config
-            )
-        try:
-            self.browser_reader.download_table_of_contents(path)
-        except Exception as e:
-            DMMRipper.logger.exception(e)
-
-    def download_book_page(self, book, page_num, path, attempts=2):
-        download_success = False
-        while attempts > 0 and not download_success:
-            if self.browser_reader == None:
-                self.browser_reader = DMMBrowserReader(
-                    self.driver, book, self.webdriver_config
-                )
-            try:
-                self.browser_reader.download_page(page_num, path)
-                download_success = True
-            except Exception as e:
-                DMMRipper.logger.exception(e)
-                attempts = attempts - 1
-        if not download_success:
-            raise Exception('Page downloads attemps exceeded.')
-
-    def close_broser_reader(self):
-        if self.browser_reader:
-            self.browser_reader.close()
-            self.browser_reader = None
-
 def main(argv):
     DMM_EMAIL = argv[0] 
     DMM_PASSWORD = argv[1]
 
     from data.config import Config
-    dmm = DMMRipper.get_instance(Config['WEBDRIVER'])
+    dmm = DMMRipper.get_instance(Config.WEBDRIVER, Config.SCRAPER)
     session = dmm.get_session(DMM_EMAIL, DMM_PASSWORD)
     books = dmm.get_purchased_books(session)
     for book in books:
@@ -29,7 +29,8 @@ language_codes = {'en': ['english', '英語'], 'ja': ['japanese','日本語']}
 db_manager = Database.get_instance()
 scheduler = CronJobManager.get_instance(
     languages=lang, max_upload_size=Config.MAX_UPLOAD_SIZE, \
-    webdriver_config=Config.WEBDRIVER
+    webdriver_config=Config.WEBDRIVER, scraper_config=Config.SCRAPER,
+    scheduler_config=Config.SCHEDULER
 )
 scheduler.set_download_path(Config.DOWNLOAD_PATH)
 
@@ -43,6 +44,7 @@ def main():
     updater = Updater(Config.TOKEN, \
         request_kwargs={'read_timeout': 10, 'connect_timeout': 10})
     dispatcher = updater.dispatcher
+    scheduler.resume_book_jobs(updater.bot)
 
     intro_wizard_handler = StartWizard(lang, language_codes, 0)
     config_handler = ConfigWizard(
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+volatile_markup_regex = re.compile(
+    r'<script.*?</script>|<input[^>]*>|<!--.*?-->', re.S | re.I
+)
+
+class HTTPCache():
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, cache_path):
+        self.cache_path = os.path.abspath(cache_path)
+
+    @staticmethod
+    def get_content_hash(text):
+        # Scripts and form tokens change on every request.
+        stable_text = volatile_markup_regex.sub('', text)
+        return hashlib.sha1(stable_text.encode('utf-8')).hexdigest()
+
+    def get_user_path(self, user_id):
+        return os.path.join(self.cache_path, str(user_id))
+
+    def get_entry_path(self, user_id, key):
+        return os.path.join(
+            self.get_user_path(user_id),
+            '{}.json'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+        )
+
+    def get(self, user_id, key):
+        try:
+            with open(self.get_entry_path(user_id, key), 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (IOError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def set(self, user_id, key, data, content_hash, etag=None,
+        last_modified=None):
+
+        user_path = self.get_user_path(user_id)
+        if not os.path.exists(user_path):
+            os.makedirs(user_path, exist_ok=True)
+        entry = {
+            'key': key,
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_hash': content_hash,
+            'data': data
+        }
+        file_descriptor, temp_path = tempfile.mkstemp(dir=user_path)
+        try:
+            with os.fdopen(file_descriptor, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(temp_path, self.get_entry_path(user_id, key))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def remove(self, user_id, key):
+        try:
+            os.remove(self.get_entry_path(user_id, key))
+        except OSError:
+            pass
+
+    def remove_user(self, user_id):
+        HTTPCache.logger.info('Removing HTTP cache of user %s', user_id)
+        shutil.rmtree(self.get_user_path(user_id), ignore_errors=True)
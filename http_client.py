@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from collections import Counter
+from data.config import Config
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+import logging
+import random
+import requests
+import threading
+import time
+
+retry_statuses = (429, 500, 502, 503, 504)
+
+class RequestBudget():
+
+    def __init__(self, requests_per_second, burst):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens \
+                    + (now - self.updated) * self.requests_per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.requests_per_second
+            time.sleep(delay)
+
+class HTTPClient():
+    logger = logging.getLogger(__name__)
+    __instance = None
+
+    def __init__(self, http_config=None):
+        if HTTPClient.__instance != None:
+            raise Exception('This class is a singleton!')
+        else:
+            http_config = http_config or Config.HTTP
+            self.timeout = (
+                http_config['CONNECT_TIMEOUT'], http_config['READ_TIMEOUT']
+            )
+            self.max_attempts = http_config['MAX_ATTEMPTS']
+            self.backoff_factor = http_config['BACKOFF_FACTOR']
+            self.backoff_max = http_config['BACKOFF_MAX']
+            # Mounted on every session, they all share the per host
+            # keep-alive connection pools.
+            self.adapter = HTTPAdapter(
+                pool_connections=http_config['POOL_CONNECTIONS'],
+                pool_maxsize=http_config['POOL_MAXSIZE']
+            )
+            # Shared by every library refresh, whatever their concurrency.
+            self.refresh_budget = RequestBudget(
+                http_config['REFRESH_REQUESTS_PER_SECOND'],
+                http_config['REFRESH_BURST']
+            )
+            self.session = self.create_session()
+            self.metrics = {}
+            self.lock = threading.Lock()
+            HTTPClient.__instance = self
+
+    @staticmethod
+    def get_instance(http_config=None):
+        if HTTPClient.__instance == None:
+            HTTPClient.logger.info('HTTPClient singleton instantiated')
+            HTTPClient(http_config)
+        return HTTPClient.__instance
+
+    def create_session(self):
+        session = requests.Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def set_refresh_budget(self, session):
+        session.request_budget = self.refresh_budget
+
+    def get_backoff(self, attempt_num):
+        # Full jitter, concurrent retries do not hit the server together.
+        return random.uniform(0, min(
+            self.backoff_max, self.backoff_factor * 2 ** (attempt_num - 1)
+        ))
+
+    def get_retry_after(self, response):
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        if retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            try:
+                delay = (parsedate_to_datetime(retry_after) \
+                    - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoff_max, max(0, delay))
+
+    def record(self, endpoint, elapsed, status=None, retried=False):
+        with self.lock:
+            metrics = self.metrics.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'status': Counter(),
+                'total_time': 0.0,
+                'max_time': 0.0
+            })
+            metrics['requests'] += 1
+            if status == None:
+                metrics['errors'] += 1
+            else:
+                metrics['status'][status] += 1
+            if retried:
+                metrics['retries'] += 1
+            metrics['total_time'] += elapsed
+            metrics['max_time'] = max(metrics['max_time'], elapsed)
+
+    def get_metrics(self):
+        with self.lock:
+            return dict((endpoint, dict(metrics, status=dict(metrics['status']),
+                average_time=metrics['total_time'] / metrics['requests'])) \
+                for endpoint, metrics in self.metrics.items())
+
+    def log_metrics(self):
+        for endpoint, metrics in sorted(self.get_metrics().items()):
+            HTTPClient.logger.info('%s: %s requests, %s errors, %s retries, ' \
+                + '%.3fs average, %.3fs max, statuses %s', endpoint,
+                metrics['requests'], metrics['errors'], metrics['retries'],
+                metrics['average_time'], metrics['max_time'],
+                metrics['status'])
+
+    def request(self, method, url, session=None, endpoint=None,
+        max_attempts=None, **kwargs):
+
+        session = session or self.session
+        endpoint = endpoint or url
+        max_attempts = max_attempts or self.max_attempts
+        kwargs.setdefault('timeout', self.timeout)
+        request_budget = getattr(session, 'request_budget', None)
+        attempt_num = 0
+        while True:
+            attempt_num += 1
+            retry = attempt_num < max_attempts
+            if request_budget:
+                request_budget.acquire()
+            start = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(endpoint, time.monotonic() - start, retried=retry)
+                if not retry:
+                    raise
+                delay = self.get_backoff(attempt_num)
+                HTTPClient.logger.info('Request to %s failed: %s, attempt ' \
+                    + '%s out of %s, retrying in %.1fs', endpoint, e,
+                    attempt_num, max_attempts, delay)
+            else:
+                retry = retry and response.status_code in retry_statuses
+                self.record(endpoint, time.monotonic() - start,
+                    response.status_code, retried=retry)
+                if not retry:
+                    return response
+                delay = self.get_retry_after(response)
+                if delay == None:
+                    delay = self.get_backoff(attempt_num)
+                response.close()
+                HTTPClient.logger.info('Request to %s answered %s, attempt ' \
+                    + '%s out of %s, retrying in %.1fs', endpoint,
+                    response.status_code, attempt_num, max_attempts, delay)
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
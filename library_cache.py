@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from collections import OrderedDict
+from data.config import Config
+
+import logging
+import threading
+
+class LibraryCache():
+    logger = logging.getLogger(__name__)
+    __instance = None
+
+    def __init__(self, max_articles=None, max_queries=None):
+        if LibraryCache.__instance != None:
+            raise Exception('This class is a singleton!')
+        else:
+            self.max_articles = max_articles \
+                or Config.LIBRARY_CACHE['MAX_ARTICLES']
+            self.max_queries = max_queries \
+                or Config.LIBRARY_CACHE['MAX_QUERIES']
+            # Least recently used users first.
+            self.users = OrderedDict()
+            self.generations = {}
+            self.size = 0
+            self.lock = threading.Lock()
+            LibraryCache.__instance = self
+
+    @staticmethod
+    def get_instance():
+        if LibraryCache.__instance == None:
+            LibraryCache.logger.info('LibraryCache singleton instantiated')
+            LibraryCache()
+        return LibraryCache.__instance
+
+    def get_generation(self, user_id):
+        with self.lock:
+            return self.generations.get(user_id, 0)
+
+    def get_language_code(self, user_id):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry == None:
+                return None
+            return entry['language_code']
+
+    def get_page(self, user_id, query, offset):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry == None or (query, offset) not in entry['queries']:
+                return None
+            self.users.move_to_end(user_id)
+            entry['queries'].move_to_end((query, offset))
+            return entry['queries'][(query, offset)]
+
+    def get_article(self, user_id, key):
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry == None:
+                return None
+            return entry['articles'].get(key)
+
+    def set_page(self, user_id, language_code, query, offset, page, articles,
+        generation):
+
+        with self.lock:
+            # The library changed while the page was being built.
+            if self.generations.get(user_id, 0) != generation:
+                return
+            entry = self.users.pop(user_id, None)
+            if entry == None:
+                entry = {
+                    'language_code': language_code,
+                    'articles': {},
+                    'queries': OrderedDict()
+                }
+            else:
+                self.size -= len(entry['articles'])
+            entry['articles'].update(articles)
+            entry['queries'][(query, offset)] = page
+            entry['queries'].move_to_end((query, offset))
+            while len(entry['queries']) > self.max_queries:
+                entry['queries'].popitem(last=False)
+            self.users[user_id] = entry
+            self.size += len(entry['articles'])
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_articles and len(self.users) > 1:
+            user_id, entry = self.users.popitem(last=False)
+            self.size -= len(entry['articles'])
+            LibraryCache.logger.info('Evicting the library cache of user %s',
+                user_id)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generations[user_id] = self.generations.get(user_id, 0) + 1
+            entry = self.users.pop(user_id, None)
+            if entry != None:
+                self.size -= len(entry['articles'])
+                LibraryCache.logger.info('Invalidating the library cache ' \
+                    + 'of user %s', user_id)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from page_manifest import PageManifest, write_atomic
+from PIL import Image
+
+import io
+import logging
+import threading
+
+def encode_page(png_data, path):
+    jpg_data = io.BytesIO()
+    jpg_img = Image.open(io.BytesIO(png_data)).convert('RGB')
+    jpg_img.save(
+        jpg_data, 'JPEG', optimize=True, progressive=True, quality=85
+    )
+    jpg_data = jpg_data.getvalue()
+    write_atomic(path + '.jpg', jpg_data)
+    return PageManifest.get_page_entry(jpg_data)
+
+class PageEncoder():
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_workers, max_pending):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        # Captures block once this many pages wait to be encoded.
+        self.pending = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, png_data, path):
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(encode_page, png_data, path)
+        except Exception:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    @staticmethod
+    def encode(png_data, path, page_encoder=None):
+        if page_encoder:
+            return page_encoder.submit(png_data, path)
+        future = Future()
+        try:
+            future.set_result(encode_page(png_data, path))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        PageEncoder.logger.info('Shutting down the page encoder.')
+        self.executor.shutdown()
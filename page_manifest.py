@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from datetime import datetime
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+def write_atomic(path, data):
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as tmp_file:
+        tmp_file.write(data)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_path, path)
+
+class PageManifest():
+    logger = logging.getLogger(__name__)
+    file_name = 'manifest.json'
+    # Bytes ending every complete JPEG file.
+    jpeg_end = b'\xff\xd9'
+
+    def __init__(self, book_path):
+        self.book_path = book_path
+        self.path = os.path.join(book_path, PageManifest.file_name)
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def load(book_path):
+        manifest = PageManifest(book_path)
+        if os.path.exists(manifest.path):
+            with open(manifest.path) as manifest_file:
+                pages = json.load(manifest_file)['pages']
+            manifest.pages = dict((int(page_num), page) \
+                for page_num, page in pages.items())
+        else:
+            manifest.migrate()
+        return manifest
+
+    @staticmethod
+    def get_page_path(book_path, page_num):
+        return os.path.join(book_path, '{}.jpg'.format(page_num))
+
+    @staticmethod
+    def get_page_entry(data):
+        return {
+            'size': len(data),
+            'checksum': hashlib.sha256(data).hexdigest(),
+            'captured': datetime.utcnow().isoformat()
+        }
+
+    def migrate(self):
+        # Directories from before the manifest, half-written pages are left
+        # out so they are captured again.
+        if os.path.isdir(self.book_path):
+            for file in os.listdir(self.book_path):
+                page_num = file.split('.jpg')[0]
+                if not file.endswith('.jpg') or not page_num.isdigit():
+                    continue
+                with open(os.path.join(self.book_path, file), 'rb') as page:
+                    data = page.read()
+                if data.endswith(PageManifest.jpeg_end):
+                    self.pages[int(page_num)] = \
+                        PageManifest.get_page_entry(data)
+            PageManifest.logger.info('Migrated %s pages of %s to a page ' \
+                + 'manifest', len(self.pages), self.book_path)
+            self.save()
+
+    def save(self):
+        data = json.dumps({'pages': self.pages}, sort_keys=True)
+        write_atomic(self.path, data.encode('utf-8'))
+
+    def add_page(self, page_num, page):
+        with self.lock:
+            self.pages[page_num] = page
+            self.save()
+
+    def get_missing_pages(self, num_pages):
+        missing_pages = []
+        for page_num in range(1, num_pages + 1):
+            page = self.pages.get(page_num)
+            try:
+                if page and os.path.getsize(PageManifest.get_page_path(
+                    self.book_path, page_num)) == page['size']:
+
+                    continue
+            except OSError:
+                pass
+            missing_pages.append(page_num)
+        return missing_pages
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+from datetime import datetime, timedelta
+
+import logging
+import math
+import random
+
+login_requests = 2 # login form and credentials
+
+class RefreshPlanner():
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, window_minutes, requests_per_second,
+        library_page_size, new_volumes_ratio):
+
+        self.window = timedelta(minutes=window_minutes)
+        self.requests_per_second = requests_per_second
+        self.library_page_size = library_page_size
+        self.new_volumes_ratio = new_volumes_ratio
+
+    def estimate_requests(self, user):
+        # Library pages, a volumes page per series and a details page per new
+        # volume, expected from the size of the library.
+        items = user['series'] + user['volumes']
+        return login_requests + user['series'] \
+            + int(math.ceil(items / self.library_page_size)) \
+            + int(math.ceil(items * self.new_volumes_ratio))
+
+    def plan(self, users, start_time):
+        if not users:
+            return [], timedelta(0)
+        # Most stale libraries first, the largest ones first among them.
+        users = sorted(users, key=lambda user: (
+            user['cache_expire_date'] or datetime.min,
+            -user['series'] - user['volumes']
+        ))
+        durations = [timedelta(
+            seconds=self.estimate_requests(user) / self.requests_per_second
+        ) for user in users]
+        duration = sum(durations, timedelta(0))
+        # Spreads the users over the whole window when the budget allows it.
+        scale = max(1, self.window / duration)
+        plan = []
+        offset = timedelta(0)
+        for user, user_duration in zip(users, durations):
+            slot = user_duration * scale
+            # Jittered inside the spare time of the slot, the requests of a
+            # refresh never overlap the next one.
+            plan.append((
+                user['user'],
+                start_time + offset \
+                    + (slot - user_duration) * random.uniform(0, 1)
+            ))
+            offset += slot
+        if duration > self.window:
+            RefreshPlanner.logger.warning('Refreshing %s libraries takes %s, ' \
+                + 'longer than the %s refresh window', len(users), duration,
+                self.window)
+        return plan, duration
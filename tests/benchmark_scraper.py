@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*-coding:utf-8 -*-
+
+import argparse
+import os, sys, time
+from unittest import mock
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+import dmm_parser
+import dmm_ripper as dmm
+from tests.dmm_server import DMMStandInServer
+
+def measure_parse(server, parser_name, iterations):
+    parser = dmm_parser.get_parser(parser_name, server.base_url)
+    fixtures = [
+        ('get_purchased_books', 'library_page_1.html', parser.get_books_list),
+        ('get_book_volumes', 'series_page_1.html', parser.get_books_list),
+        ('get_book_details', 'details.html', parser.get_book_details)
+    ]
+    results = []
+    for name, fixture, extract in fixtures:
+        text = server.get_fixture(fixture) \
+            .replace('{base_url}', server.base_url).replace('{token}', '0')
+        start = time.perf_counter()
+        for i in range(iterations):
+            extract(parser.parse(text))
+        results.append((name, (time.perf_counter() - start) / iterations))
+    return results
+
+def measure_crawl(server, parser_name, concurrent, iterations):
+    ripper = server.create_ripper(parser_name, concurrent)
+    session = dmm.requests.Session()
+    series = None
+    results = []
+    for name in ('get_purchased_books', 'get_book_volumes',
+        'get_book_details'):
+
+        server.requests = []
+        start = time.perf_counter()
+        for i in range(iterations):
+            if name == 'get_purchased_books':
+                series = ripper.get_purchased_books(session)[0]
+            elif name == 'get_book_volumes':
+                ripper.get_book_volumes(session, series)
+            else:
+                ripper.get_book_details(session,
+                    server.base_url + '/detail/b200/')
+        elapsed = time.perf_counter() - start
+        results.append((name, len(server.requests) / elapsed))
+    return results
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark DMM scraping against the offline fixtures.')
+    arg_parser.add_argument('--delay', type=float, default=0.05,
+        help='simulated server latency in seconds')
+    arg_parser.add_argument('--iterations', type=int, default=20)
+    args = arg_parser.parse_args()
+
+    server = DMMStandInServer(delay=args.delay).start()
+    library_patch = mock.patch.object(dmm, 'library_url',
+        server.base_url + '/library/')
+    library_patch.start()
+    try:
+        for parser_name in dmm_parser.parsers:
+            print('Parser: {}'.format(parser_name))
+            for name, latency in measure_parse(server, parser_name,
+                args.iterations):
+
+                print('  {:<20} parse latency {:8.2f} ms'.format(
+                    name, latency * 1000))
+            for concurrent in (False, True):
+                for name, rate in measure_crawl(server, parser_name,
+                    concurrent, args.iterations):
+
+                    print('  {:<20} {:<10} {:8.2f} pages/sec'.format(name,
+                        'concurrent' if concurrent else 'sequential', rate))
+    finally:
+        library_patch.stop()
+        server.stop()
+        dmm.DMMRipper._DMMRipper__instance = None
+
+if __name__ == '__main__':
+    main()
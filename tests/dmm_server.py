@@ -0,0 +1,124 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+import dmm_parser
+import dmm_ripper as dmm
+
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'fixtures')
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class DMMRequestHandler(BaseHTTPRequestHandler):
+
+    routes = [
+        (re.compile(r'^/library/$'), 'library_page_{page}.html'),
+        (re.compile(r'^/series/[0-9]+/$'), 'series_page_{page}.html'),
+        (re.compile(r'^/detail/[^/]+/$'), 'details.html')
+    ]
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        page = parse_qs(url.query).get('page', ['1'])[0]
+        self.server.stand_in.register_request(url.path)
+        if self.server.stand_in.delay:
+            time.sleep(self.server.stand_in.delay)
+
+        fixture = None
+        for route, fixture_name in DMMRequestHandler.routes:
+            if route.match(url.path):
+                fixture = self.server.stand_in.get_fixture(
+                    fixture_name.format(page=page)
+                )
+                if fixture == None and url.path == '/library/':
+                    fixture = self.server.stand_in.get_fixture(
+                        'library_end.html'
+                    )
+                break
+        if fixture == None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        etag = '"{}"'.format(hashlib.sha1(fixture.encode('utf-8')).hexdigest())
+        if self.server.stand_in.etags \
+            and self.headers.get('If-None-Match') == etag:
+
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        body = fixture.replace('{base_url}', self.server.stand_in.base_url) \
+            .replace('{token}', uuid.uuid4().hex).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.stand_in.etags:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class DMMStandInServer():
+
+    def __init__(self, delay=0, etags=False):
+        self.delay = delay
+        self.etags = etags
+        self.fixtures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DMMRequestHandler)
+        self.server.stand_in = self
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def get_fixture(self, name):
+        if name not in self.fixtures:
+            fixture_path = os.path.join(fixtures_path, name)
+            if not os.path.exists(fixture_path):
+                return None
+            with open(fixture_path, 'r', encoding='utf-8') as fixture_file:
+                self.fixtures[name] = fixture_file.read()
+        return self.fixtures[name]
+
+    def create_ripper(self, parser=dmm_parser.LxmlParser.name, concurrent=True,
+        http_cache_path=None):
+
+        dmm.DMMRipper._DMMRipper__instance = None
+        with mock.patch.object(dmm, 'book_url', self.base_url):
+            return dmm.DMMRipper.get_instance(
+                {'POOL_SIZE': 1},
+                {
+                    'CONCURRENT_PAGES': concurrent,
+                    'MAX_WORKERS': 4,
+                    'PARSER': parser,
+                    'HTTP_CACHE_PATH': http_cache_path,
+                    'FULL_REFRESH_DAYS': 7
+                }
+            )
+
+    def register_request(self, path):
+        with self.lock:
+            self.requests.append(path)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
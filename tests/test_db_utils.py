@@ -0,0 +1,138 @@
+import unittest
+import os, sys, shutil, tempfile
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+from db_utils import Database
+
+def create_entry(title, url, serie=None, description=None):
+    return {
+        'serie': serie,
+        'volume': {
+            'title': title,
+            'url': url,
+            'thumbnail_dmm': url + '.jpg',
+            'description': description,
+            'pages': 100
+        }
+    }
+
+series = {'title': '星降る町の物語', 'url': 'series/1', 'thumbnail_dmm': 's1.jpg'}
+
+library_entries = [
+    create_entry('星降る町の物語 第1巻', 'volume/1', series, '港町の図書館'),
+    create_entry('星降る町の物語 第2巻', 'volume/2', series, '港町の灯台'),
+    create_entry('海辺のカフェ', 'volume/3', description='星降る夜の出会い'),
+    create_entry('夜明けの図書館', 'volume/4', description='司書の物語'),
+    create_entry('旅の終わりに', 'volume/5')
+]
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.db_path = tempfile.mkdtemp()
+        self.db_schema_name = Database.db_schema_name
+        Database.db_schema_name = os.path.join(self.db_path, 'dmm.db')
+        Database._Database__instance = None
+        self.db_manager = Database.get_instance()
+        self.session = self.db_manager.create_session()
+        self.db_manager.insert_user(self.session, 1)
+
+    def tearDown(self):
+        self.db_manager.remove_session()
+        self.db_manager.engine.dispose()
+        Database._Database__instance = None
+        Database.db_schema_name = self.db_schema_name
+        shutil.rmtree(self.db_path)
+
+    def store_library(self, entries, chunk_size=None):
+        index = self.db_manager.get_library_index(self.session, 1)
+        return self.db_manager.store_user_volumes(self.session, 1, entries,
+            index, chunk_size)
+
+    def get_titles(self, books):
+        return [book.title for book in books]
+
+    def test_store_chunk_fallback(self):
+        entries = list(library_entries)
+        # Titles are mandatory, the whole chunk fails and is stored again
+        # one volume at a time.
+        entries.insert(1, create_entry(None, 'volume/6'))
+        created, failed = self.store_library(entries, chunk_size=3)
+        self.assertEqual(['volume/6'],
+            [entry['volume']['url'] for entry in failed])
+        self.assertEqual(6, len(created))
+        self.assertEqual(5, len(self.db_manager.get_user_volume_urls(
+            self.session, 1)))
+        # Stored volumes are only linked to another user.
+        self.db_manager.insert_user(self.session, 2)
+        index = self.db_manager.get_library_index(self.session, 2)
+        created, failed = self.db_manager.store_user_volumes(self.session, 2,
+            library_entries[:2], index)
+        self.assertEqual(([], []), (created, failed))
+        self.assertEqual(['volume/1', 'volume/2'], sorted(
+            self.db_manager.get_user_volume_urls(self.session, 2)))
+
+    def test_search_by_title(self):
+        if not self.db_manager.search_enabled:
+            self.skipTest('requires the SQLite FTS5 trigram tokenizer')
+        self.store_library(library_entries)
+        # Titles rank before descriptions.
+        self.assertEqual(['星降る町の物語', '海辺のカフェ'], self.get_titles(
+            self.db_manager.get_user_library_by_title(self.session, 1,
+                '星降る')))
+        self.assertEqual(['夜明けの図書館'], self.get_titles(
+            self.db_manager.get_user_library_by_title(self.session, 1,
+                '図書館')))
+        series_id = self.db_manager.get_manga_serie(self.session,
+            'series/1').id
+        self.assertEqual(['星降る町の物語 第2巻'], self.get_titles(
+            self.db_manager.get_user_volumes_from_serie(self.session, 1,
+                series_id, '町の灯台')))
+        # Shorter than a trigram, matched on titles only.
+        self.assertEqual(['夜明けの図書館'], self.get_titles(
+            self.db_manager.get_user_library_by_title(self.session, 1,
+                '夜明')))
+        volume = self.db_manager.get_manga_volume(self.session, 'volume/5')
+        volume.title = '夕焼けの旅'
+        self.db_manager.commit(self.session)
+        self.assertEqual(['夕焼けの旅'], self.get_titles(
+            self.db_manager.get_user_library_by_title(self.session, 1,
+                '夕焼け')))
+
+    def test_search_pagination(self):
+        self.store_library(library_entries)
+        titles = self.get_titles(self.db_manager.get_user_library_by_title(
+            self.session, 1, ''))
+        self.assertEqual(['夜明けの図書館', '旅の終わりに', '星降る町の物語',
+            '海辺のカフェ'], titles)
+        pages = [self.get_titles(self.db_manager.get_user_library_by_title(
+            self.session, 1, '', offset, 3)) for offset in (0, 3, 6)]
+        self.assertEqual([titles[:3], titles[3:], []], pages)
+        series_id = self.db_manager.get_manga_serie(self.session,
+            'series/1').id
+        self.assertEqual(['星降る町の物語 第2巻'], self.get_titles(
+            self.db_manager.get_user_volumes_from_serie(self.session, 1,
+                series_id, ' ', 1, 1)))
+
+    def test_book_job_progress(self):
+        self.store_library(library_entries)
+        volume_id = self.db_manager.get_manga_volume(self.session,
+            'volume/3').id
+        self.db_manager.insert_book_job(self.session, volume_id)
+        self.db_manager.set_book_job_progress(volume_id, 40)
+        # A resumed job keeps its progress.
+        self.db_manager.insert_book_job(self.session, volume_id)
+        self.session.expire_all()
+        self.assertEqual([(volume_id, 40)], [(job.volume_id,
+            job.pages_captured) for job in self.db_manager.get_book_jobs(
+                self.session)])
+        self.db_manager.insert_book_job_subscriber(self.session, volume_id, 1)
+        self.db_manager.remove_book_job(self.session, volume_id)
+        self.assertEqual([], self.db_manager.get_book_jobs(self.session))
+        self.assertEqual([], self.db_manager.get_book_job_subscribers(
+            self.session))
+
+if __name__ == '__main__':
+    unittest.main()
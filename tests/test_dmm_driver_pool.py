@@ -0,0 +1,123 @@
+import unittest
+import os, sys, threading, time
+from unittest import mock
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+import dmm_driver_pool
+from constants import JobPriority
+from dmm_driver_pool import DMMDriver, DMMDriverPool
+from urllib.parse import urlparse
+
+class FakeDriver():
+
+    def __init__(self, worker_id, webdriver_config):
+        self.worker_id = worker_id
+
+    def reset(self):
+        pass
+
+    def close_driver(self):
+        pass
+
+class FakeWebDriver():
+
+    def __init__(self):
+        self.current_url = dmm_driver_pool.blank_url
+        # Cookies by domain, webdriver only reaches the visited one.
+        self.cookies = {}
+
+    def get(self, url):
+        self.current_url = url
+
+    def get_domain(self):
+        return urlparse(self.current_url).hostname
+
+    def add_cookie(self, cookie):
+        if cookie['domain'].lstrip('.') != self.get_domain():
+            raise Exception('Invalid cookie domain')
+        self.cookies.setdefault(self.get_domain(), []).append(cookie)
+
+    def delete_all_cookies(self):
+        self.cookies.pop(self.get_domain(), None)
+
+class TestDMMDriver(unittest.TestCase):
+
+    def test_close_session(self):
+        driver = DMMDriver.__new__(DMMDriver)
+        driver.worker_id = 0
+        driver.driver = FakeWebDriver()
+        driver.browser_reader = None
+        driver.session_domains = set()
+        driver.add_session_cookies([
+            {'name': 'login_session_id', 'domain': '.dmm.com'},
+            {'name': 'ckcy', 'domain': 'book.dmm.com'}
+        ])
+        self.assertEqual(['book.dmm.com', 'dmm.com'],
+            sorted(driver.driver.cookies))
+        self.assertEqual(dmm_driver_pool.blank_url, driver.driver.current_url)
+        driver.browser_reader = mock.Mock()
+        driver.driver.get('https://book.dmm.co.jp/reader/')
+        driver.driver.add_cookie({'name': 'reader', 'domain': 'book.dmm.co.jp'})
+        driver.reset()
+        self.assertEqual({}, driver.driver.cookies)
+        self.assertEqual(set(), driver.session_domains)
+        self.assertEqual(dmm_driver_pool.blank_url, driver.driver.current_url)
+
+class TestDMMDriverPool(unittest.TestCase):
+
+    def setUp(self):
+        for name, value in (('DMMDriver', FakeDriver),
+            ('lease_poll_interval', 0.01)):
+
+            patcher = mock.patch.object(dmm_driver_pool, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pool = DMMDriverPool({'POOL_SIZE': 1})
+
+    def wait_for_waiters(self, num_waiters):
+        deadline = time.monotonic() + 5
+        while sum(self.pool.waiters.values()) < num_waiters:
+            self.assertTrue(time.monotonic() < deadline)
+            time.sleep(0.01)
+
+    def lease(self, priority, leases):
+        driver = self.pool.lease(5, priority)
+        leases.append(priority)
+        self.pool.release(driver)
+
+    def test_lease_by_priority(self):
+        driver = self.pool.lease(priority=JobPriority.refresh)
+        leases = []
+        threads = []
+        for priority in (JobPriority.thumbnail, JobPriority.refresh,
+            JobPriority.download):
+
+            thread = threading.Thread(target=self.lease,
+                args=(priority, leases))
+            thread.start()
+            threads.append(thread)
+            self.wait_for_waiters(len(threads))
+        self.assertTrue(self.pool.is_outranked(JobPriority.refresh))
+        self.assertFalse(self.pool.is_outranked(JobPriority.download))
+        self.assertTrue(self.pool.has_waiters(JobPriority.download))
+        self.pool.release(driver)
+        for thread in threads:
+            thread.join(5)
+        # Returned webdrivers go to the most urgent waiter first.
+        self.assertEqual([JobPriority.download, JobPriority.refresh,
+            JobPriority.thumbnail], leases)
+        self.assertFalse(self.pool.has_waiters(JobPriority.thumbnail))
+        self.assertEqual(1, len(self.pool.drivers))
+
+    def test_lease_and_return(self):
+        driver = self.pool.lease()
+        with self.assertRaises(Exception):
+            self.pool.lease(0.05)
+        self.pool.release(driver)
+        self.assertIs(driver, self.pool.lease(0))
+        self.assertEqual(1, len(self.pool.drivers))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,46 +1,173 @@
 import unittest
-import os, sys
+import os, sys, shutil, tempfile
+from unittest import mock
 
-parentPath = os.path.abspath('..')
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if parentPath not in sys.path:
     sys.path.insert(0, parentPath)
-    import dmm_ripper as dmm
+import dmm_parser
+import dmm_ripper as dmm
+from tests.dmm_server import DMMStandInServer, fixtures_path
+
+library_titles = ['月刊少年ジャンプ作品集', '夜明けの図書館', '星降る町の物語', '海辺のカフェ',
+    '旅の終わりに', '猫と暮らす日々', '雨の日の約束', '最後の一冊']
+volume_titles = ['第1巻', '第2巻', '第3巻', '第4巻', '第5巻']
 
 class TestDMMRipper(unittest.TestCase):
-    
+
     hardcoded_login_url = 'https://www.dmm.com/my/-/login/' \
             + '=/path=DRVESRUMTh1aCl5THVILWk8GWVsf/channel=book'
 
-    email = 'fake_email@real_fake_email.com'
-    password = 'th1s1sf4k3p455'
-    valid_account = False
+    @classmethod
+    def setUpClass(cls):
+        cls.server = DMMStandInServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        dmm.DMMRipper._DMMRipper__instance = None
+
+    def setUp(self):
+        self.library_patch = mock.patch.object(dmm, 'library_url',
+            self.server.base_url + '/library/')
+        self.library_patch.start()
+        self.session = dmm.requests.Session()
+        self.server.requests = []
+
+    def tearDown(self):
+        self.library_patch.stop()
 
     def test_get_login_url(self):
-        url = dmm.get_login_url(True)
-        self.assertEqual(self.hardcoded_login_url, url)
+        ripper = self.server.create_ripper()
+        self.assertEqual(self.hardcoded_login_url, ripper.get_login_url(True))
+
+    def test_get_purchased_books(self):
+        for parser in dmm_parser.parsers:
+            for concurrent in (True, False):
+                ripper = self.server.create_ripper(parser=parser,
+                    concurrent=concurrent)
+                books = ripper.get_purchased_books(self.session)
+                self.assertEqual(library_titles,
+                    [book['name'] for book in books])
+                self.assertEqual([True, False, False, True, False, False,
+                    False, False], [book['series'] for book in books])
+                self.assertEqual(self.server.base_url + '/product/200/read/',
+                    books[1]['url'])
+                self.assertEqual(self.server.base_url + '/detail/b200/',
+                    books[1]['details_url'])
+
+    def test_get_purchased_books_incremental(self):
+        ripper = self.server.create_ripper()
+        known_urls = set(book['url'] for book in ripper.get_purchased_books(
+            self.session)[3:])
+        self.server.requests = []
+        books = ripper.get_purchased_books(self.session, known_urls=known_urls)
+        self.assertEqual(library_titles[:6], [book['name'] for book in books])
+        self.assertEqual(['/library/', '/library/'], self.server.requests)
+
+    def test_get_purchased_library_complete(self):
+        for concurrent in (True, False):
+            ripper = self.server.create_ripper(concurrent=concurrent)
+            self.assertTrue(ripper.get_purchased_library(
+                self.session)['complete'])
+            # A page inside the pagination without a books list.
+            self.server.fixtures['library_page_2.html'] = \
+                self.server.get_fixture('library_end.html')
+            try:
+                library = ripper.get_purchased_library(self.session)
+            finally:
+                self.server.fixtures.pop('library_page_2.html')
+            self.assertFalse(library['complete'])
+            self.assertTrue(library['books'])
+
+    def test_get_book_volumes(self):
+        for parser in dmm_parser.parsers:
+            ripper = self.server.create_ripper(parser=parser)
+            series = ripper.get_purchased_books(self.session)[0]
+            volumes = ripper.get_book_volumes(self.session, series)
+            self.assertEqual(volume_titles,
+                [volume['name'] for volume in volumes])
 
-        dynamic_url = dmm.get_login_url(False)
-        self.assertEqual(self.hardcoded_login_url, dynamic_url)
+    def test_get_book_details(self):
+        for parser in dmm_parser.parsers:
+            ripper = self.server.create_ripper(parser=parser)
+            details = ripper.get_book_details(self.session,
+                self.server.base_url + '/detail/b200/')
+            self.assertEqual('192', details['pages'])
+            self.assertTrue(details['description'].startswith('港町の'))
+
+    def test_http_cache(self):
+        cache_path = tempfile.mkdtemp()
+        try:
+            for etags in (True, False):
+                self.server.etags = etags
+                ripper = self.server.create_ripper(http_cache_path=cache_path)
+                books = ripper.get_purchased_books(self.session, user_id=1)
+                self.assertEqual(library_titles,
+                    [book['name'] for book in books])
+                books = ripper.get_purchased_books(self.session, user_id=1)
+                self.assertEqual(library_titles,
+                    [book['name'] for book in books])
+                self.assertFalse(any(book['changed'] for book in books))
+                ripper.clear_user_cache(1)
+        finally:
+            self.server.etags = False
+            shutil.rmtree(cache_path)
+
+class TestDMMParser(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(fixtures_path, 'mixed_content.html'), 'r',
+            encoding='utf-8') as fixture_file:
+
+            self.fixture = fixture_file.read()
+
+    def test_mixed_content(self):
+        for name, parser_class in dmm_parser.parsers.items():
+            parser = parser_class('https://dmm')
+            document = parser.parse(self.fixture)
+            self.assertEqual(['海辺のカフェ', '旅の終わりに'],
+                [book['name'] for book in parser.get_books_list(document)],
+                name)
+            self.assertEqual({
+                'description': '海辺の町に小さなカフェを開いた姉妹の一年。',
+                'pages': '208'
+            }, parser.get_book_details(document), name)
+
+class TestDMMRipperLive(unittest.TestCase):
+
+    email = 'fake_email@real_fake_email.com'
+    password = 'th1s1sf4k3p455'
+    valid_account = False
 
+    @unittest.skipUnless(os.environ.get('DMM_LIVE_TESTS'),
+        'requires access to DMM')
     def test_get_dmm_session(self):
+        dmm.DMMRipper._DMMRipper__instance = None
+        ripper = dmm.DMMRipper.get_instance(
+            {'POOL_SIZE': 1},
+            {'PARSER': dmm_parser.SoupParser.name, 'HTTP_CACHE_PATH': None}
+        )
         session = None
         try:
-            session = dmm.get_session(
-                TestDMMRipper.email,
-                TestDMMRipper.password,
+            session = ripper.get_session(
+                TestDMMRipperLive.email,
+                TestDMMRipperLive.password,
                 fast=True
             )
         except:
             pass
         finally:
-            if not TestDMMRipper.valid_account:
+            ripper.close_driver()
+            if not TestDMMRipperLive.valid_account:
                 self.assertEqual(session, None)
             else:
                 self.assertNotEqual(session, None)
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
-        TestDMMRipper.password = sys.argv.pop()
-        TestDMMRipper.email = sys.argv.pop()
-        TestDMMRipper.valid_account = True
-    unittest.main()
\ No newline at end of file
+        TestDMMRipperLive.password = sys.argv.pop()
+        TestDMMRipperLive.email = sys.argv.pop()
+        TestDMMRipperLive.valid_account = True
+        os.environ['DMM_LIVE_TESTS'] = '1'
+    unittest.main()
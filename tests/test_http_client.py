@@ -0,0 +1,98 @@
+import unittest
+import os, sys
+from unittest import mock
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+import http_client
+from http_client import HTTPClient
+
+class FakeSession():
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+def create_response(status_code, headers=None):
+    return mock.Mock(status_code=status_code, headers=headers or {})
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        HTTPClient._HTTPClient__instance = None
+        self.client = HTTPClient.get_instance({
+            'CONNECT_TIMEOUT': 1,
+            'READ_TIMEOUT': 2,
+            'POOL_CONNECTIONS': 1,
+            'POOL_MAXSIZE': 1,
+            'MAX_ATTEMPTS': 3,
+            'BACKOFF_FACTOR': 0.5,
+            'BACKOFF_MAX': 10,
+            'REFRESH_REQUESTS_PER_SECOND': 2,
+            'REFRESH_BURST': 2
+        })
+        patcher = mock.patch.object(http_client.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        HTTPClient._HTTPClient__instance = None
+
+    def test_retry_server_errors(self):
+        session = FakeSession([
+            http_client.requests.ConnectionError('reset'),
+            create_response(429, {'Retry-After': '7'}),
+            create_response(200)
+        ])
+        response = self.client.get('http://dmm/library/', session=session,
+            endpoint='library')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(session.requests), 3)
+        self.assertEqual(session.requests[0][2]['timeout'], (1, 2))
+        self.assertTrue(0 <= self.sleep.call_args_list[0][0][0] <= 0.5)
+        self.assertEqual(self.sleep.call_args_list[1][0][0], 7)
+        metrics = self.client.get_metrics()['library']
+        self.assertEqual(metrics['requests'], 3)
+        self.assertEqual(metrics['errors'], 1)
+        self.assertEqual(metrics['retries'], 2)
+        self.assertEqual(metrics['status'], {429: 1, 200: 1})
+
+    def test_attempts_exceeded(self):
+        session = FakeSession([create_response(503), create_response(503),
+            create_response(503)])
+        response = self.client.get('http://dmm/', session=session)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(session.requests), 3)
+        session = FakeSession([create_response(404)])
+        self.assertEqual(
+            self.client.get('http://dmm/', session=session).status_code, 404
+        )
+
+    def test_refresh_budget(self):
+        clock = [0.0]
+        def sleep(delay):
+            clock[0] += delay
+        self.sleep.side_effect = sleep
+        with mock.patch.object(http_client.time, 'monotonic',
+            side_effect=lambda: clock[0]):
+
+            self.client.refresh_budget = http_client.RequestBudget(2, 2)
+            session = FakeSession([create_response(200)] * 4)
+            self.client.set_refresh_budget(session)
+            for _ in range(4):
+                self.client.get('http://dmm/', session=session)
+        # The burst goes through, then two requests per second.
+        self.assertEqual([call[0][0] for call in self.sleep.call_args_list],
+            [0.5, 0.5])
+        self.assertEqual(clock[0], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os, sys
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+from library_cache import LibraryCache
+
+def create_articles(book_ids, serie=False):
+    return dict(((serie, book_id), 'article {}'.format(book_id)) \
+        for book_id in book_ids)
+
+class TestLibraryCache(unittest.TestCase):
+
+    def setUp(self):
+        LibraryCache._LibraryCache__instance = None
+        self.library_cache = LibraryCache(max_articles=10, max_queries=2)
+
+    def tearDown(self):
+        LibraryCache._LibraryCache__instance = None
+
+    def set_page(self, user_id, query, offset, book_ids, generation=None):
+        articles = create_articles(book_ids)
+        page = (list(articles.values()), '')
+        if generation == None:
+            generation = self.library_cache.get_generation(user_id)
+        self.library_cache.set_page(user_id, 'en', query, offset, page,
+            articles, generation)
+        return page
+
+    def test_pages(self):
+        page = self.set_page(1, 'a', 0, range(3))
+        self.assertIs(page, self.library_cache.get_page(1, 'a', 0))
+        self.assertEqual(None, self.library_cache.get_page(1, 'a', 20))
+        self.assertEqual('en', self.library_cache.get_language_code(1))
+        self.assertEqual('article 1',
+            self.library_cache.get_article(1, (False, 1)))
+        self.assertEqual(None, self.library_cache.get_article(1, (True, 1)))
+        # Articles are shared by the pages of a user.
+        self.set_page(1, 'a', 20, range(2, 5))
+        self.assertEqual(5, self.library_cache.size)
+        self.library_cache.get_page(1, 'a', 0)
+        self.set_page(1, 'b', 0, [1])
+        self.assertEqual([('a', 0), ('b', 0)],
+            list(self.library_cache.users[1]['queries']))
+
+    def test_invalidate(self):
+        generation = self.library_cache.get_generation(1)
+        self.set_page(1, 'a', 0, range(3), generation)
+        self.library_cache.invalidate(1)
+        self.assertEqual(None, self.library_cache.get_page(1, 'a', 0))
+        self.assertEqual(None, self.library_cache.get_language_code(1))
+        self.assertEqual(0, self.library_cache.size)
+        # Built before the library changed, the page is outdated.
+        self.set_page(1, 'a', 0, range(3), generation)
+        self.assertEqual(None, self.library_cache.get_page(1, 'a', 0))
+        self.set_page(1, 'a', 0, range(3))
+        self.assertNotEqual(None, self.library_cache.get_page(1, 'a', 0))
+
+    def test_evict_least_recently_used(self):
+        for user_id in (1, 2):
+            self.set_page(user_id, 'a', 0, range(4))
+        self.library_cache.get_page(1, 'a', 0)
+        self.set_page(3, 'a', 0, range(4))
+        self.assertEqual([1, 3], list(self.library_cache.users))
+        self.assertEqual(8, self.library_cache.size)
+        # A single library larger than the limit is still kept.
+        self.set_page(4, 'a', 0, range(20))
+        self.assertEqual([4], list(self.library_cache.users))
+
+if __name__ == '__main__':
+    unittest.main()
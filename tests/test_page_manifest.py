@@ -0,0 +1,49 @@
+import unittest
+import os, sys, shutil, tempfile
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+from page_manifest import PageManifest, write_atomic
+
+jpeg_page = b'\xff\xd8page\xff\xd9'
+
+class TestPageManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.book_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.book_path)
+
+    def write_page(self, page_num, data):
+        write_atomic(PageManifest.get_page_path(self.book_path, page_num),
+            data)
+
+    def test_migrate_legacy_directory(self):
+        self.write_page(1, jpeg_page)
+        self.write_page(2, jpeg_page[:-4])
+        self.write_page(3, jpeg_page)
+        write_atomic(os.path.join(self.book_path, 'thumbnail.jpg'), jpeg_page)
+        manifest = PageManifest.load(self.book_path)
+        self.assertEqual(manifest.get_missing_pages(4), [2, 4])
+        self.assertTrue(os.path.exists(manifest.path))
+        self.assertEqual(
+            PageManifest.load(self.book_path).pages[1]['checksum'],
+            manifest.pages[1]['checksum']
+        )
+
+    def test_missing_pages(self):
+        manifest = PageManifest.load(self.book_path)
+        self.assertEqual(manifest.get_missing_pages(3), [1, 2, 3])
+        for page_num in [1, 2]:
+            self.write_page(page_num, jpeg_page)
+            manifest.add_page(page_num, PageManifest.get_page_entry(jpeg_page))
+        # Pages on disk are only trusted once the manifest lists them.
+        self.write_page(3, jpeg_page)
+        os.remove(PageManifest.get_page_path(self.book_path, 2))
+        manifest = PageManifest.load(self.book_path)
+        self.assertEqual(manifest.get_missing_pages(3), [2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os, sys
+from datetime import datetime, timedelta
+
+parentPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parentPath not in sys.path:
+    sys.path.insert(0, parentPath)
+from refresh_planner import RefreshPlanner
+
+start_time = datetime(2019, 1, 1, 3)
+
+def create_users(libraries):
+    return [{
+        'user': index,
+        'cache_expire_date': datetime(2018, 12, 31),
+        'series': series,
+        'volumes': volumes
+    } for index, (series, volumes) in enumerate(libraries)]
+
+class TestRefreshPlanner(unittest.TestCase):
+
+    def test_spread_over_window(self):
+        planner = RefreshPlanner(60, 1, 10, 0)
+        users = create_users([(0, 100), (10, 990), (0, 5), (0, 300)])
+        users[2]['cache_expire_date'] = None
+        plan, duration = planner.plan(users, start_time)
+        self.assertEqual([user for user, _ in plan], [2, 1, 3, 0])
+        self.assertEqual(duration, timedelta(seconds=159))
+        run_dates = [run_date for _, run_date in plan]
+        self.assertEqual(run_dates, sorted(run_dates))
+        self.assertTrue(start_time <= run_dates[0])
+        self.assertTrue(run_dates[-1] < start_time + timedelta(minutes=60))
+
+    def test_requests_budget(self):
+        planner = RefreshPlanner(1, 1, 10, 0)
+        plan, duration = planner.plan(create_users([(0, 1000)] * 3),
+            start_time)
+        self.assertEqual(duration, timedelta(seconds=306))
+        # Longer than the window, the refreshes run back to back.
+        self.assertEqual([run_date for _, run_date in plan], [start_time,
+            start_time + timedelta(seconds=102),
+            start_time + timedelta(seconds=204)])
+
+    def test_estimate_requests(self):
+        planner = RefreshPlanner(60, 1, 100, 0.25)
+        # Login, two library pages, a volumes page per series and the
+        # details pages of the expected new volumes.
+        self.assertEqual(planner.estimate_requests(
+            {'series': 30, 'volumes': 120}), 72)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -82,18 +82,6 @@ def get_book_image_paths(path):
         int(x.rsplit('/', 1)[1].split('.jpg')[0])
     )
 
-def get_book_page_num_list(path):
-    book_images = []
-    for file in os.listdir(path):
-        if file.endswith('.jpg') and file != 'thumbnail.jpg':
-            page_num = int(file.split('.jpg')[0])
-            book_images.append(page_num)
-    book_images.sort()
-    return book_images
-
-def book_missing_pages(start_page, end_page, page_list):
-    return sorted(set(range(start_page, end_page + 1)).difference(page_list))
-
 def get_book_download_path(base_path, book):
     if book.serie_id:
         return '{}/{}-{}/{}-{}'.format(